@@ -0,0 +1,74 @@
+import numpy as np
+
+# every function works along the first (date) axis of a (date) or (date x region) array of floats,
+# using cumulative sums so a whole pivoted array is computed at once; windows running past the
+# first date or over a missing value give NaN
+
+
+def daily(cumulative):
+    '''
+    returns the daily increase of a cumulative count, the first date counting in full
+    '''
+    cumulative = np.asarray(cumulative, dtype=float)
+    return np.diff(cumulative, axis=0, prepend=np.zeros((1,) + cumulative.shape[1:]))
+
+def shifted(values, periods):
+    '''
+    returns values delayed by periods dates, NaN filled
+    '''
+    result = np.full(values.shape, np.nan)
+    if periods < len(values):
+        result[periods:] = values[:len(values) - periods]
+    return result
+
+def rolling_sum(values, window):
+    '''
+    sums values over the window dates ending on each date
+    '''
+    values = np.asarray(values, dtype=float)
+    zero = np.zeros((1,) + values.shape[1:])
+    totals = np.concatenate([zero, np.nancumsum(values, axis=0)])
+    missing = np.concatenate([zero, np.cumsum(np.isnan(values), axis=0)])
+    result = np.full(values.shape, np.nan)
+    if window <= len(values):
+        result[window - 1:] = totals[window:] - totals[:-window]
+        result[window - 1:][missing[window:] - missing[:-window] > 0] = np.nan
+    return result
+
+def moving_average(values, window=7):
+    '''
+    averages values over the window dates ending on each date
+    '''
+    return rolling_sum(values, window) / window
+
+def growth(values, window=7):
+    '''
+    percentage change of the sum of values over the window dates ending on each date from the
+    window before it, e.g. week-over-week growth of new cases
+    '''
+    current = rolling_sum(values, window)
+    previous = shifted(current, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = 100 * (current / previous - 1)
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+def doubling_time(cumulative, window=7):
+    '''
+    days a cumulative count would take to double at the growth rate of the last window dates;
+    NaN where it did not grow
+    '''
+    cumulative = np.asarray(cumulative, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = window * np.log(2) / np.log(cumulative / shifted(cumulative, window))
+    result[~np.isfinite(result) | (result <= 0)] = np.nan
+    return result
+
+# derived metrics offered next to the counts: the cumulative count they are computed from, how,
+# and whether the result is a count (which can then be shown per 100,000 of population)
+derived_metrics = {'New cases (7-day average)': ('Confirmed', lambda values: moving_average(daily(values), 7), True),
+                   'New cases (14-day average)': ('Confirmed', lambda values: moving_average(daily(values), 14), True),
+                   'New deaths (7-day average)': ('Deaths', lambda values: moving_average(daily(values), 7), True),
+                   'Cases in the last 7 days': ('Confirmed', lambda values: rolling_sum(daily(values), 7), True),
+                   'Week-over-week growth (%)': ('Confirmed', lambda values: growth(daily(values), 7), False),
+                   'Doubling time (days)': ('Confirmed', lambda values: doubling_time(values, 7), False)}
@@ -1,19 +1,41 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
 import pandas as pd
 import numpy as np
 from datetime import datetime
 import plotly.express as px
-import plotly.graph_objects as go
+from plotly.colors import make_colorscale, sequential
 import pycountry
+import os
+import logging
+import threading
+import time
+from bisect import bisect_right
+
+from cache import LazyHandle, make_cache, sizeof
+from instrumentation import instrument_app, phase
+from response_cache import install_response_cache
+from analytics import derived_metrics, moving_average
+from figures import figure, title
+from spatial import aggregate_cells, within
+from downsample import detail_indices, week_ends, weekly
+from datasets import SHARED_DATA_DIR, file_signatures, load_datasets, load_who, refresh_frames, source_version
+
+logging.basicConfig(level=logging.INFO)
 
 app = dash.Dash(__name__)
 server = app.server
 app.config.suppress_callback_exceptions = True
 app.title = 'COVID-19 Analysis'
 
+# CALLBACK_METRICS instruments every callback below and serves the measurements on /metrics
+if os.environ.get('CALLBACK_METRICS'):
+    instrument_app(app,
+                   profile_rate=float(os.environ.get('CALLBACK_PROFILE_RATE', 0)),
+                   profile_dir=os.environ.get('CALLBACK_PROFILE_DIR'))
+
 dash_colors = {
     'background': '#343231',
     'text': '#BEBEBE',
@@ -23,22 +45,71 @@ dash_colors = {
     'green': '#5bc246'
 }
 
+logger = logging.getLogger(__name__)
+
 def get_country_code(name):
     try:
         return pycountry.countries.lookup(name).alpha_3
-    except:
+    except LookupError:
         return None
 
-df_master = pd.read_csv('data/WHO-COVID-19-global-data.csv')
-df_master['iso_alpha_3'] = df_master['Country'].apply(get_country_code)
+def load_country_aliases(path='country_aliases.csv'):
+    '''
+    reads the ISO-3 codes of country names the WHO or regional files spell differently from pycountry;
+    an empty code marks a name that knowingly has none
+    '''
+    aliases = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), path),
+                          keep_default_na=False, encoding='utf-8')
+    return dict(zip(aliases['name'], aliases['iso_alpha_3']))
+
+country_aliases = load_country_aliases()
+
+def resolve_country_codes(countries):
+    '''
+    looks up the ISO-3 code of each distinct country name once and maps it onto every row
+    '''
+    codes = {}
+    for name in countries.dropna().unique():
+        code = country_aliases[name] if name in country_aliases else get_country_code(name)
+        codes[name] = code or None
+    unresolved = sorted(name for name, code in codes.items() if code is None and name not in country_aliases)
+    if unresolved:
+        logger.warning('no ISO-3 code for %d countries (add them to country_aliases.csv): %s',
+                       len(unresolved), ', '.join(unresolved))
+    return countries.map(codes).astype('category')
 
-df_worldwide = pd.read_csv('data/df_worldwide.csv')
-df_worldwide['percentage'] = df_worldwide['percentage'].astype(str)
-df_worldwide['date'] = pd.to_datetime(df_worldwide['date'])
+snapshot_columns = ['Cumulative_cases', 'New_cases', 'Cumulative_deaths', 'New_deaths']
 
-available_countries = sorted(df_worldwide['Country/Region'].unique())
+def build_snapshot(who, position=-1, population=None):
+    '''
+    builds the values per country (plus a 'Worldwide' total) reported on a date of the WHO
+    aggregates, by default the latest. Given the population of each country, the values are per
+    100,000 of population and countries without one are left out.
+    '''
+    reported = who['reported'][position]
+    rows = {column: who['values'][column][position] for column in snapshot_columns}
+    if population is None:
+        snapshot = {country: {column: int(rows[column][i]) for column in snapshot_columns}
+                    for i, country in enumerate(who['countries']) if reported[i]}
+        snapshot['Worldwide'] = {column: int(rows[column][reported].sum()) for column in snapshot_columns}
+        return snapshot
+    reported = reported & ~np.isnan(population)
+    snapshot = {country: {column: float(rows[column][i] / population[i]) for column in snapshot_columns}
+                for i, country in enumerate(who['countries']) if reported[i]}
+    if reported.any():
+        snapshot['Worldwide'] = {column: float(rows[column][reported].sum() / population[reported].sum())
+                                 for column in snapshot_columns}
+    return snapshot
 
+# reports back from the latest one that the indicator deltas compare against
+delta_references = {'day': 1, 'week': 7}
 
+def build_reference_snapshots(who, population=None):
+    '''
+    builds the snapshots the indicator deltas are measured from, for each reference that has data
+    '''
+    return {reference: build_snapshot(who, -1 - offset, population)
+            for reference, offset in delta_references.items() if offset < len(who['dates'])}
 
 states = ['Alabama', 'Alaska', 'Arizona', 'Arkansas', 'California',
           'Colorado', 'Connecticut', 'Delaware', 'District of Columbia',
@@ -70,403 +141,620 @@ china = ['Anhui', 'Beijing', 'Chongqing', 'Fujian', 'Gansu', 'Guangdong',
          'Shaanxi', 'Shandong', 'Shanghai', 'Shanxi', 'Sichuan', 'Tianjin',
          'Tibet', 'Xinjiang', 'Yunnan', 'Zhejiang']
 
-region_options = {'Worldwide': available_countries,
-                  'United States': states,
-                  'Europe': eu,
-                  'China': china}
-
-df_us = pd.read_csv('data/df_us.csv')
-df_us['percentage'] = df_us['percentage'].astype(str)
-df_us['date'] = pd.to_datetime(df_us['date'])
+def build_series_store(df, date_column, region_column, metrics, population_column=None):
+    '''
+    pivots a long-form dataset once into dense (date x region) arrays for each metric
+    '''
+    grouped = df.groupby([date_column, region_column], observed=True)[metrics].sum().unstack(region_column)
+    regions = grouped.columns.get_level_values(1).unique()
+    store = {'dates': np.asarray(grouped.index),
+             'index': {region: i for i, region in enumerate(regions)},
+             'values': {},
+             'totals': {},
+             'per_capita': {}}
+    for metric in metrics:
+        values = grouped[metric].reindex(columns=regions).to_numpy(dtype=float)
+        store['values'][metric] = values
+        store['totals'][metric] = np.nansum(values, axis=1)
 
-df_eu = pd.read_csv('data/df_eu.csv')
-df_eu['percentage'] = df_eu['percentage'].astype(str)
-df_eu['date'] = pd.to_datetime(df_eu['date'])
+    if population_column is not None:
+        population = df.groupby([date_column, region_column], observed=True)[population_column].first() \
+                       .unstack(region_column).reindex(index=grouped.index, columns=regions).to_numpy(dtype=float)
+        store['population'] = population
+        for metric in metrics:
+            store['per_capita'][metric] = store['values'][metric] / population
+    return store
 
-df_china = pd.read_csv('data/df_china.csv')
-df_china['percentage'] = df_china['percentage'].astype(str)
-df_china['date'] = pd.to_datetime(df_china['date'])
+def build_who_series(who, population):
+    '''
+    builds a series store of the daily WHO counts, NaN where a country did not report, with the
+    counts per 100,000 of population of the countries that have one; the worldwide per capita
+    totals are taken over those countries only
+    '''
+    values = {metric: np.where(who['reported'], who['values'][metric], np.nan) for metric in ['New_cases', 'New_deaths']}
+    known = ~np.isnan(population)
+    return {'dates': np.array(who['dates'], dtype=object),
+            'index': {country: i for i, country in enumerate(who['countries'])},
+            'values': values,
+            'totals': {metric: np.nansum(series, axis=1) for metric, series in values.items()},
+            'population': population,
+            'per_capita': {metric: series / population for metric, series in values.items()},
+            'per_capita_totals': {metric: np.nansum(series[:, known], axis=1) / population[known].sum()
+                                  for metric, series in values.items()} if known.any() else {}}
 
-df_us_counties = pd.concat([pd.read_csv('data/df_us_county1.csv'),
-                            pd.read_csv('data/df_us_county2.csv'),
-                            pd.read_csv('data/df_us_county3.csv'),
-                            pd.read_csv('data/df_us_county4.csv')], ignore_index=True)
-df_us_counties['percentage'] = df_us_counties['percentage'].astype(str)
-df_us_counties['Country/Region'] = df_us_counties['Country/Region'].astype(str)
-df_us_counties['date'] = pd.to_datetime(df_us_counties['date'])
+def build_who_population(iso_alpha_3, worldwide):
+    '''
+    joins a population to each WHO country through its ISO-3 code: the WHO file has none, so the
+    country population table is taken from the latest date of the worldwide regional file, in the
+    same units of 100,000. NaN where a country has no population.
+    '''
+    latest = worldwide[worldwide['date'] == worldwide['date'].max()]
+    codes = resolve_country_codes(latest['Country/Region'].astype(object))
+    table = pd.Series(latest['population'].to_numpy(dtype=float), index=codes.to_numpy(dtype=object))
+    table = table[table.index.notna() & table.notna()].groupby(level=0).first()
+    return pd.Series(iso_alpha_3).map(table).to_numpy(dtype=float)
 
-#DONE
-@app.callback(
-    Output('confirmed_ind', 'figure'),
-    [Input('demo-dropdown', 'value')])
-def confirmed(view):
+def store_column(store, values, region):
     '''
-    creates the CUMULATIVE CONFIRMED indicator
+    returns the series of one region from a (date x region) array of the store
     '''
-    df_cumulative = df_master[df_master['Date_reported'] == max(df_master['Date_reported'])]
-    value = 0
-    if view == 'Worldwide':
-        value = df_cumulative['Cumulative_cases'].sum()
+    if region not in store['index']:
+        return np.empty(0)
+    return values[:, store['index'][region]]
+
+regional_metrics = ['Confirmed', 'Deaths', 'Recovered', 'Active']
+
+# points per trace sent to the line charts; zooming in fetches the zoomed range in more detail
+SERIES_MAX_POINTS = int(os.environ.get('SERIES_MAX_POINTS', 400))
 
+def zoom_window(dates, relayout):
+    '''
+    returns the (start, stop) positions of the dates within the x-axis range a chart was zoomed
+    to, or None when it shows the whole range
+    '''
+    relayout = relayout or {}
+    if 'xaxis.range[0]' in relayout and 'xaxis.range[1]' in relayout:
+        low, high = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    elif 'xaxis.range' in relayout:
+        low, high = relayout['xaxis.range']
     else:
-        temp_df = df_cumulative[df_cumulative['Country']==view]
-        value = temp_df['Cumulative_cases'].sum()
-        print(value)
-        print(view)
-
-
-    return {
-            'data': [{'type': 'indicator',
-                    'mode': 'number+delta',
-                    'value': value,
-                    'number': {'valueformat': ',',
-                              'font': {'size': 50}},
-                    'domain': {'y': [0, 1], 'x': [0, 1]}}],
-            'layout': go.Layout(
-                title={'text': "CUMULATIVE CONFIRMED CASES"},
-                font=dict(color=dash_colors['red']),
-                paper_bgcolor=dash_colors['background'],
-                plot_bgcolor=dash_colors['background'],
-                height=200
-                )
-            }
-def human_format(num):
-    num = float('{:.3g}'.format(num))
-    magnitude = 0
-    while abs(num) >= 1000:
-        magnitude += 1
-        num /= 1000.0
-    return '{}{}'.format('{:f}'.format(num).rstrip('0').rstrip('.'), ['', 'K', 'M', 'B', 'T'][magnitude])
+        return None
+    dates = pd.DatetimeIndex(pd.to_datetime(dates))
+    return dates.searchsorted(pd.Timestamp(low)), dates.searchsorted(pd.Timestamp(high), side='right')
 
+def level_of_detail(dates, y, resolution, window=None, how='last'):
+    '''
+    reduces a series to what its chart can show: weekly values ('sum' or 'last' of each week), or
+    daily values downsampled to SERIES_MAX_POINTS with the zoomed window kept in detail
+    '''
+    if not len(y):
+        return dates[:0], y
+    if resolution == 'weekly':
+        return dates[week_ends(len(dates))], weekly(y, how)
+    indices = detail_indices(y, SERIES_MAX_POINTS, window)
+    return dates[indices], y[indices]
 
-@app.callback(
-    Output('active_ind', 'figure'),
-    [Input('demo-dropdown', 'value')])
-def active(view):
+# dataset, scope, projection and marker size reference of the map for each view
+map_views = {'Worldwide': ('worldwide', 'world', 'natural earth', 35),
+             'United States': ('us_counties', 'usa', 'albers usa', 7),
+             'Europe': ('eu', 'europe', 'natural earth', 15),
+             'China': ('china', 'asia', 'natural earth', 3)}
+
+# dataset of the sub-region chart for each view
+series_datasets = {'Worldwide': 'worldwide',
+                   'United States': 'us',
+                   'Europe': 'eu',
+                   'China': 'china'}
+
+# datasets loaded at startup besides the WHO data; those of the other views are loaded the first
+# time a callback needs them
+eager_datasets = ['worldwide']
+
+# seconds a regional view can go unused before its tables are dropped (0 keeps them)
+VIEW_IDLE_SECONDS = float(os.environ.get('VIEW_IDLE_SECONDS', 1800))
+
+def build_view(view, frames):
     '''
-    creates the New cases in last 24 hours indicator
+    derives the tables of one view from its frames: the sub-region series and the map rows by
+    date, keeping the frames so a refresh can append to them
     '''
-    value = 0
-    df_latest = df_master[df_master['Date_reported'] == max(df_master['Date_reported'])]
-    if view == 'Worldwide':
-        value = df_latest['New_cases'].sum()
+    df_map = frames[map_views[view][0]]
+    return {'series': build_series_store(frames[series_datasets[view]], 'date', 'Country/Region', regional_metrics, 'population'),
+            'map_frame': df_map,
+            'map_dates': df_map['date'].unique(),
+            'map_rows': df_map.groupby('date').indices,
+            'frames': {name: frames[name] for name in (series_datasets[view], map_views[view][0])}}
 
-    else:
-        df_latest = df_latest[df_latest['Country']==view]
-        value = df_latest['New_cases'].sum()
-
-    return {
-            'data': [{'type': 'indicator',
-                    'mode': 'number+delta',
-                    'value': value,
-                    'number': {'valueformat': ',',
-                              'font': {'size': 50}},
-                    'domain': {'y': [0, 1], 'x': [0, 1]}}],
-            'layout': go.Layout(
-                title={'text': "New Cases (24hrs)"},
-                font=dict(color=dash_colors['red']),
-                paper_bgcolor=dash_colors['background'],
-                plot_bgcolor=dash_colors['background'],
-                height=200
-                )
-            }
+def view_loader(view, frames, preloaded=None):
+    '''
+    returns a function building a view, which loads any of its datasets not already in frames;
+    the refreshed frames in preloaded are used for the first build only, so a view dropped when
+    idle does not keep them
+    '''
+    preloaded = dict(preloaded or {})
+    def load():
+        start = time.perf_counter()
+        names = {series_datasets[view], map_views[view][0]}
+        available = dict(frames, **{name: preloaded.pop(name) for name in names if name in preloaded})
+        missing = [name for name in names if name not in available]
+        view_frames = dict(available, **load_datasets(missing)) if missing else available
+        tables = build_view(view, view_frames)
+        logger.info('%s view loaded in %.2f s', view, time.perf_counter() - start)
+        return tables
+    return load
 
-@app.callback(
-    Output('recovered_ind', 'figure'),
-    [Input('demo-dropdown', 'value')])
-def recovered(view):
+def view_tables(state, view):
     '''
-    creates the CUMULATIVE DEATHS indicator
+    returns the tables of a view (Worldwide for unknown views), loading them on first use
     '''
-    df_cumulative = df_master[df_master['Date_reported'] == max(df_master['Date_reported'])]
-    value = 0
-    if view == 'Worldwide':
-        value = df_cumulative['Cumulative_deaths'].sum()
+    return state['views'].get(view, state['views']['Worldwide']).get()
 
-    else:
-        temp_df = df_cumulative[df_cumulative['Country'] == view]
-        value = temp_df['Cumulative_deaths'].sum()
-        print(value)
-        print(view)
-
-
-    return {
-            'data': [{'type': 'indicator',
-                    'mode': 'number+delta',
-                    'value': value,
-                    'number': {'valueformat': ',',
-                              'font': {'size': 50}},
-                    'domain': {'y': [0, 1], 'x': [0, 1]}}],
-            'layout': go.Layout(
-                title={'text': "CUMULATIVE DEATHS"},
-                font=dict(color=dash_colors['red']),
-                paper_bgcolor=dash_colors['background'],
-                plot_bgcolor=dash_colors['background'],
-                height=200
-                )
-            }
+def build_data(frames, who, version, view_frames=None):
+    '''
+    derives every table the callbacks read from the loaded frames and the WHO aggregates; callbacks
+    only ever see a complete result, which is swapped in as a whole when the data is refreshed.
+    Regional views are built lazily, the first time they are asked for, from view_frames where
+    those hold their datasets.
+    '''
+    views = {view: LazyHandle(view_loader(view, frames, view_frames), None if view == 'Worldwide' else VIEW_IDLE_SECONDS)
+             for view in map_views}
+    views['Worldwide'].get()
+    iso_alpha_3 = np.asarray(resolve_country_codes(pd.Series(who['countries'])), dtype=object)
+    population = build_who_population(iso_alpha_3, frames['worldwide'])
+    return {'version': version,
+            'signatures': file_signatures(),
+            'frames': frames,
+            'who': who,
+            'iso_alpha_3': iso_alpha_3,
+            'snapshot': build_snapshot(who),
+            'reference_snapshots': build_reference_snapshots(who),
+            'snapshot_per_capita': build_snapshot(who, population=population),
+            'reference_snapshots_per_capita': build_reference_snapshots(who, population),
+            'master_series': build_who_series(who, population),
+            'views': views,
+            'region_options': {'Worldwide': sorted(frames['worldwide']['Country/Region'].unique()),
+                               'United States': states,
+                               'Europe': eu,
+                               'China': china},
+            'trajectory_dates': who['dates']}
 
-@app.callback(
-    Output('deaths_ind', 'figure'),
-    [Input('demo-dropdown', 'value')])
-def deaths(view):
+data = build_data(load_datasets(eager_datasets), load_who(), source_version())
+
+indicators = [('Cumulative_cases', "CUMULATIVE CONFIRMED CASES"),
+              ('New_cases', "New Cases (24hrs)"),
+              ('Cumulative_deaths', "CUMULATIVE DEATHS"),
+              ('New_deaths', "New Deaths (24hrs)")]
+
+def indicator_figure(value, reference, name, valueformat=','):
     '''
-    creates the DEATHS TO DATE indicator
+    creates one indicator, with the change from the reference value when there is one
     '''
-    value = 0
-    df_latest = df_master[df_master['Date_reported'] == max(df_master['Date_reported'])]
-    if view == 'Worldwide':
-        value = df_latest['New_deaths'].sum()
+    indicator = {'type': 'indicator',
+                 'mode': 'number',
+                 'value': value,
+                 'number': {'valueformat': valueformat,
+                           'font': {'size': 50}},
+                 'domain': {'y': [0, 1], 'x': [0, 1]}}
+    if reference is not None:
+        indicator['mode'] = 'number+delta'
+        indicator['delta'] = {'reference': reference,
+                              'valueformat': valueformat,
+                              'increasing': {'color': dash_colors['blue']},
+                              'decreasing': {'color': dash_colors['green']}}
+    return figure([indicator],
+                  {'title': title(name),
+                   'font': {'color': dash_colors['red']},
+                   'paper_bgcolor': dash_colors['background'],
+                   'plot_bgcolor': dash_colors['background'],
+                   'height': 200})
+
+# regions selected in the upper-right chart when a view is chosen, and for any other view
+default_regions = {'Worldwide': ['US', 'Italy', 'United Kingdom', 'Spain', 'Russia', 'Brazil', 'Sweden', 'Belgium', 'Peru', 'India', 'Lithuania'],
+                   'United States': ['New York', 'New Jersey', 'California', 'Texas', 'Florida', 'Mississippi', 'Arizona', 'Louisiana', 'Colorado'],
+                   'Europe': ['France', 'Germany', 'Italy', 'Spain', 'United Kingdom', 'Belgium', 'Sweden', 'Lithuania'],
+                   'China': ['Hubei', 'Guangdong', 'Xinjiang', 'Zhejiang', 'Hunan', 'Hong Kong', 'Macau']}
+fallback_regions = ['US', 'Italy', 'United Kingdom', 'Spain', 'France', 'Germany', 'Russia']
+
+def default_selection(view):
+    '''
+    returns the regions selected by default in the upper-right chart for a view
+    '''
+    return default_regions.get(view, fallback_regions)
+
+def snapshot_rows(snapshot, digits=None):
+    '''
+    packs a snapshot into a row of the indicator values per country, rounded to digits if given
+    '''
+    return {country: [values[column] if digits is None else round(values[column], digits) for column, _ in indicators]
+            for country, values in snapshot.items()}
+
+def build_bundle(state):
+    '''
+    packs the static lookups of the indicators and region drop-down into one compact bundle that
+    is sent with the page, so the browser answers those controls itself (assets/dashboard.js):
+    the latest and reference snapshots as rows per country, absolute and per 100,000, with the
+    indicator figure to fill in, and the region options and default selections of each view
+    '''
+    return {'titles': [name for _, name in indicators],
+            'indicator': indicator_figure(0, 0, ''),
+            'snapshots': {'absolute': dict({'latest': snapshot_rows(state['snapshot'])},
+                                           **{reference: snapshot_rows(snapshot)
+                                              for reference, snapshot in state['reference_snapshots'].items()}),
+                          'percent': dict({'latest': snapshot_rows(state['snapshot_per_capita'], 6)},
+                                          **{reference: snapshot_rows(snapshot, 6)
+                                             for reference, snapshot in state['reference_snapshots_per_capita'].items()})},
+            'formats': {'absolute': [',', ''], 'percent': [',.2f', ' per 100,000']},
+            'region_options': state['region_options'],
+            'default_regions': default_regions,
+            'fallback_regions': fallback_regions}
+
+def page_bundle(state):
+    '''
+    returns the bundle of a data version, building it for the first page served from it
+    '''
+    if 'bundle' not in state:
+        state['bundle'] = build_bundle(state)
+    return state['bundle']
+
+# the four indicators (cumulative and 24 hour cases and deaths), looked up in the page bundle;
+# per 100,000 of population when selected and the country has a population
+app.clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='indicator_strip'),
+    [Output('confirmed_ind', 'figure'),
+     Output('active_ind', 'figure'),
+     Output('recovered_ind', 'figure'),
+     Output('deaths_ind', 'figure')],
+    [Input('demo-dropdown', 'value'),
+     Input('delta_reference', 'value'),
+     Input('population_select', 'value')],
+    [State('dashboard_bundle', 'data')])
+
+def human_format(num):
+    num = float('{:.3g}'.format(num))
+    magnitude = 0
+    while abs(num) >= 1000:
+        magnitude += 1
+        num /= 1000.0
+    return '{}{}'.format('{:f}'.format(num).rstrip('0').rstrip('.'), ['', 'K', 'M', 'B', 'T'][magnitude])
 
-    else:
-        df_latest = df_latest[df_latest['Country'] == view]
-        value = df_latest['New_deaths'].sum()
-
-    return {
-            'data': [{'type': 'indicator',
-                    'mode': 'number+delta',
-                    'value': value,
-                    'number': {'valueformat': ',',
-                              'font': {'size': 50}},
-                    'domain': {'y': [0, 1], 'x': [0, 1]}}],
-            'layout': go.Layout(
-                title={'text': "New Deaths (24hrs)"},
-                font=dict(color=dash_colors['red']),
-                paper_bgcolor=dash_colors['background'],
-                plot_bgcolor=dash_colors['background'],
-                height=200
-                )
-            }
 
 @app.callback(
     Output('worldwide_trend', 'figure'),
-    [Input('demo-dropdown', 'value')])
-def worldwide_trend(view):
+    [Input('demo-dropdown', 'value'),
+     Input('resolution_select', 'value'),
+     Input('population_select', 'value'),
+     Input('worldwide_trend', 'relayoutData')])
+def worldwide_trend(view, resolution, population, relayout):
     '''
     creates the upper-left chart (aggregated stats for the view)
     '''
-    if view == 'Worldwide':
-        confirmed = df_master.groupby('Date_reported')['New_cases'].sum()
-        deaths = df_master.groupby('Date_reported')['New_deaths'].sum()
-
+    master_series = data['master_series']
+    # per 100,000 of population when selected and the country has a population
+    if population != 'percent':
+        per_capita = False
+    elif view == 'Worldwide':
+        per_capita = bool(master_series['per_capita_totals'])
     else:
-        temp_df = df_master[df_master['Country']==view]
-        confirmed = temp_df.groupby('Date_reported')['New_cases'].sum()
-        deaths = temp_df.groupby('Date_reported')['New_deaths'].sum()
-
-
-    title_suffix = ''
-    hover = '%{y:,g}'
-
-    traces = [go.Scatter(
-                    x=df_master.groupby('Date_reported')['Date_reported'].first(),
-                    y=confirmed,
-                    hovertemplate=hover,
-                    name="Confirmed",
-                    mode='lines'),
-
-                go.Scatter(
-                    x=df_master.groupby('Date_reported')['Date_reported'].first(),
-                    y=deaths,
-                    hovertemplate=hover,
-                    name="Deaths",
-                    mode='lines')]
-    return {
-            'data': traces,
-            'layout': go.Layout(
-                title="{} Infections{}".format(view, title_suffix),
-                xaxis_title="Date",
-                yaxis_title="Number of Cases",
-                font=dict(color=dash_colors['text']),
-                paper_bgcolor=dash_colors['background'],
-                plot_bgcolor=dash_colors['background'],
-                xaxis=dict(gridcolor=dash_colors['grid']),
-                yaxis=dict(gridcolor=dash_colors['grid'])
-                )
-            }
+        per_capita = view in master_series['index'] and not np.isnan(master_series['population'][master_series['index'][view]])
+    with phase('data'):
+        if view == 'Worldwide':
+            totals = master_series['per_capita_totals' if per_capita else 'totals']
+            confirmed = totals['New_cases']
+            deaths = totals['New_deaths']
 
-@app.callback(
+        else:
+            values = master_series['per_capita' if per_capita else 'values']
+            confirmed = store_column(master_series, values['New_cases'], view)
+            deaths = store_column(master_series, values['New_deaths'], view)
+        window = zoom_window(master_series['dates'], relayout) if resolution != 'weekly' else None
+        averages = [level_of_detail(master_series['dates'], moving_average(series, 7), resolution, window)
+                    for series in (confirmed, deaths)] if resolution != 'weekly' else []
+        confirmed_dates, confirmed = level_of_detail(master_series['dates'], confirmed, resolution, window, 'sum')
+        deaths_dates, deaths = level_of_detail(master_series['dates'], deaths, resolution, window, 'sum')
+
+    title_suffix = (' per 100,000' if per_capita else '') + (' (weekly)' if resolution == 'weekly' else '')
+    hover = '%{y:,.2f}' if per_capita else '%{y:,g}'
+
+    traces = [{'type': 'scatter',
+               'x': confirmed_dates,
+               'y': confirmed,
+               'hovertemplate': hover,
+               'name': "Confirmed",
+               'mode': 'lines'},
+
+              {'type': 'scatter',
+               'x': deaths_dates,
+               'y': deaths,
+               'hovertemplate': hover,
+               'name': "Deaths",
+               'mode': 'lines'}]
+    for (x, y), name in zip(averages, ["Confirmed (7-day average)", "Deaths (7-day average)"]):
+        traces.append({'type': 'scatter',
+                       'x': x,
+                       'y': y,
+                       'hovertemplate': '%{y:,.2f}' if per_capita else '%{y:,.1f}',
+                       'name': name,
+                       'mode': 'lines',
+                       'line': {'dash': 'dot'}})
+    return figure(traces,
+                  {'title': title("{} Infections{}".format(view, title_suffix)),
+                   'font': {'color': dash_colors['text']},
+                   'paper_bgcolor': dash_colors['background'],
+                   'plot_bgcolor': dash_colors['background'],
+                   'xaxis': {'title': title("Date"), 'gridcolor': dash_colors['grid']},
+                   'yaxis': {'title': title("Number of Cases"), 'gridcolor': dash_colors['grid']},
+                   # keeps the user's zoom when the detail for it arrives
+                   'uirevision': view})
+
+# allowable options for regions in the upper-right chart drop-down
+app.clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='set_active_options'),
     Output('country_select', 'options'),
-    [Input('global_format', 'value')])
-def set_active_options(selected_view):
-    '''
-    sets allowable options for regions in the upper-right chart drop-down
-    '''
-    return [{'label': i, 'value': i} for i in region_options[selected_view]]
+    [Input('global_format', 'value')],
+    [State('dashboard_bundle', 'data')])
 
-@app.callback(
+# default selections for regions in the upper-right chart drop-down
+app.clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='set_countries_value'),
     Output('country_select', 'value'),
     [Input('global_format', 'value'),
-     Input('country_select', 'options')])
-def set_countries_value(view, available_options):
-    '''
-    sets default selections for regions in the upper-right chart drop-down
-    '''
-    if view == 'Worldwide':
-        return ['US', 'Italy', 'United Kingdom', 'Spain', 'Russia', 'Brazil', 'Sweden', 'Belgium', 'Peru', 'India', 'Lithuania']
-    elif view == 'United States':
-        return ['New York', 'New Jersey', 'California', 'Texas', 'Florida', 'Mississippi', 'Arizona', 'Louisiana', 'Colorado']
-    elif view == 'Europe':
-        return ['France', 'Germany', 'Italy', 'Spain', 'United Kingdom', 'Belgium', 'Sweden', 'Lithuania']
-    elif view == 'China':
-        return ['Hubei', 'Guangdong', 'Xinjiang', 'Zhejiang', 'Hunan', 'Hong Kong', 'Macau']
-    else:
-        return ['US', 'Italy', 'United Kingdom', 'Spain', 'France', 'Germany', 'Russia']
+     Input('country_select', 'options')],
+    [State('dashboard_bundle', 'data')])
+
+# (dates, values) of each region in the sub-region chart by data version and chart settings, so a
+# selection in any order, or with regions added, reuses the regions already computed
+region_series = make_cache('region_series', max_bytes=int(os.environ.get('REGION_SERIES_CACHE_BYTES', 64 * 2**20)))
 
 @app.callback(
     Output('active_countries', 'figure'),
     [Input('global_format', 'value'),
      Input('country_select', 'value'),
      Input('column_select', 'value'),
-     Input('population_select', 'value')])
-def active_countries(view, countries, column, population):
+     Input('population_select', 'value'),
+     Input('resolution_select', 'value'),
+     Input('active_countries', 'relayoutData')])
+def active_countries(view, countries, column, population, resolution, relayout):
     '''
     creates the upper-right chart (sub-region analysis)
     '''
-    '''if df_master['Country'] == 'India':
-        df_master[:,:].drop()'''
-
-    if view == 'Worldwide':
-        df = df_worldwide
-    elif view == 'United States':
-        df = df_us
-    elif view == 'Europe':
-        df = df_eu
-    elif view == 'China':
-        df = df_china
-    else:
-        df = df_worldwide
+    state = data
+    if view not in state['views']:
+        view = 'Worldwide'
+    with phase('data'):
+        store = view_tables(state, view)['series']
+        window = zoom_window(store['dates'], relayout) if resolution != 'weekly' else None
 
-    if population == 'absolute':
+    derived = derived_metrics.get(column)
+    if derived is not None and not derived[2]:
+        # rates do not depend on the population
+        population = 'absolute'
+        column_label = column
+        values = store['values']
+        hover = '%{y:,.1f}<br>%{x}'
+    elif population == 'absolute':
         column_label = column
+        values = store['values']
         hover = '%{y:,g}<br>%{x}'
     elif population == 'percent':
         column_label = '{} per 100,000'.format(column)
-        df = df.dropna(subset=['population'])
+        values = store['per_capita']
         hover = '%{y:,.2f}<br>%{x}'
     else:
         column_label = column
+        values = store['values']
         hover = '%{y:,g}<br>%{x}'
 
+    # regions are ordered by their latest confirmed count; those without a value on the latest date are left out
+    with phase('data'):
+        latest = store['values']['Confirmed'][-1]
+        if population == 'percent':
+            latest = np.where(np.isnan(store['population'][-1]), np.nan, latest)
+        countries = [country for country in dict.fromkeys(countries or [])
+                     if country in store['index'] and not np.isnan(latest[store['index'][country]])]
+        countries.sort(key=lambda country: latest[store['index'][country]], reverse=True)
+
+        # only the regions not cached for these settings are computed, all at once
+        key = (state['version'], view, column, population, resolution, window)
+        series = {country: region_series.get(key + (country,)) for country in countries}
+        missing = [country for country, cached in series.items() if cached is None]
+        if missing:
+            columns = [store['index'][country] for country in missing]
+            if derived is not None:
+                source, derive, _ = derived
+                selected = derive(values[source][:, columns])
+            else:
+                selected = values[column][:, columns]
+            for i, country in enumerate(missing):
+                series[country] = level_of_detail(store['dates'], selected[:, i], resolution, window)
+                region_series.set(key + (country,), series[country])
+
     traces = []
-    countries = df[(df['Country/Region'].isin(countries)) &
-                   (df['date'] == df['date'].max())].groupby('Country/Region')['Confirmed'].sum().sort_values(ascending=False).index.to_list()
     for country in countries:
-        if population == 'absolute':
-            y_data = df[df['Country/Region'] == country].groupby('date')[column].sum()
-            recovered = df[df['Country/Region'] == 'Recovered'].groupby('date')[column].sum()
-        elif population == 'percent':
-            y_data = df[df['Country/Region'] == country].groupby('date')[column].sum() / df[df['Country/Region'] == country].groupby('date')['population'].first()
-            recovered = df[df['Country/Region'] == 'Recovered'].groupby('date')[column].sum() / df[df['Country/Region'] == country].groupby('date')['population'].first()
-        else:
-            y_data = df[df['Country/Region'] == country].groupby('date')[column].sum()
-            recovered = df[df['Country/Region'] == 'Recovered'].groupby('date')[column].sum()
-
-        traces.append(go.Scatter(
-                    x=df[df['Country/Region'] == country].groupby('date')['date'].first(),
-                    y=y_data,
-                    hovertemplate=hover,
-                    name=country,
-                    mode='lines'))
+        x, y = series[country]
+        traces.append({'type': 'scatter',
+                       'x': x,
+                       'y': y,
+                       'hovertemplate': hover,
+                       'name': country,
+                       'mode': 'lines'})
     if column == 'Recovered':
-        traces.append(go.Scatter(
-                    x=df[df['Country/Region'] == 'Recovered'].groupby('date')['date'].first(),
-                    y=recovered,
-                    hovertemplate=hover,
-                    name='Unidentified',
-                    mode='lines'))
-    return {
-            'data': traces,
-            'layout': go.Layout(
-                    title="{} by Region".format(column_label),
-                    xaxis_title="Date",
-                    yaxis_title="Number of Cases",
-                    font=dict(color=dash_colors['text']),
-                    paper_bgcolor=dash_colors['background'],
-                    plot_bgcolor=dash_colors['background'],
-                    xaxis=dict(gridcolor=dash_colors['grid']),
-                    yaxis=dict(gridcolor=dash_colors['grid']),
-                    hovermode='closest'
-                )
-            }
+        x, y = level_of_detail(store['dates'], store_column(store, values[column], 'Recovered'), resolution, window)
+        traces.append({'type': 'scatter',
+                       'x': x,
+                       'y': y,
+                       'hovertemplate': hover,
+                       'name': 'Unidentified',
+                       'mode': 'lines'})
+    return figure(traces,
+                  {'title': title("{} by Region{}".format(column_label, ' (weekly)' if resolution == 'weekly' else '')),
+                   'font': {'color': dash_colors['text']},
+                   'paper_bgcolor': dash_colors['background'],
+                   'plot_bgcolor': dash_colors['background'],
+                   'xaxis': {'title': title("Date"), 'gridcolor': dash_colors['grid']},
+                   'yaxis': {'title': title("Number of Cases"), 'gridcolor': dash_colors['grid']},
+                   'hovermode': 'closest',
+                   'uirevision': view})
+
+map_frames = make_cache('map_frames', max_bytes=int(os.environ.get('MAP_FRAME_CACHE_BYTES', 256 * 2**20)))
+
+# hover text of the map markers, filled in by the browser from each marker's text (the region
+# name) and customdata (its confirmed count and week-over-week change, or share for grid cells)
+marker_hover = '%{text}: %{customdata[0]:,} total cases, %{customdata[1]:.1f}% from previous week<extra></extra>'
+cell_hover = '%{text}: %{customdata[0]:,.0f} total cases, %{customdata[1]:.1f}% in the previous week<extra></extra>'
+# plotly's 'Reds', spelled out since plotly.js has a different scale of the same name
+map_colorscale = make_colorscale(sequential.Reds)
+
+def build_map_frame(state, view, date_index):
+    '''
+    builds the marker arrays and hover values of the map for one view and date
+    '''
+    tables = view_tables(state, view)
+    df = tables['map_frame']
+    df = df.iloc[tables['map_rows'][tables['map_dates'][date_index]]]
+    df = df[df['Confirmed'] > 0]
+    return {'lon': df['Longitude'].to_numpy(),
+            'lat': df['Latitude'].to_numpy(),
+            'size': np.sqrt(df['Confirmed']).to_numpy(),
+            'color': df['share_of_last_week'].to_numpy(),
+            'confirmed': df['Confirmed'].to_numpy(),
+            'label': df['Country/Region'].astype(str).to_numpy(dtype=object),
+            'change': df['percentage'].to_numpy(dtype=float)}
+
+def get_map_frame(state, view, date_index):
+    '''
+    returns the cached map frame for a view and date, building it on first use
+    '''
+    dates = view_tables(state, view)['map_dates']
+    if not -len(dates) <= date_index < len(dates):
+        raise IndexError('date index {} out of range for {}'.format(date_index, view))
+    key = (state['version'], view, date_index % len(dates))
+    frame = map_frames.get(key)
+    if frame is None:
+        frame = build_map_frame(state, view, date_index % len(dates))
+        map_frames.set(key, frame)
+    return frame
+
+# latest dates of each view warmed in a shared cache, which evicts nothing that would bound the warm-up
+MAP_FRAME_WARMUP_SHARED = int(os.environ.get('MAP_FRAME_WARMUP_SHARED', 7))
+
+def warm_map_frames():
+    '''
+    pre-builds map frames of the loaded views from the most recent date backwards, stopping before
+    a frame would take the cache over its byte budget, so the latest frames are never evicted
+    '''
+    state = data
+    counts = {view: len(handle.get()['map_dates']) for view, handle in state['views'].items() if handle.loaded}
+    depth = max(counts.values(), default=0)
+    if map_frames.shared:
+        depth = min(depth, MAP_FRAME_WARMUP_SHARED)
+    for offset in range(1, depth + 1):
+        for view, count in counts.items():
+            if offset > count:
+                continue
+            key = (state['version'], view, count - offset)
+            if key in map_frames:
+                continue
+            frame = build_map_frame(state, view, count - offset)
+            if not map_frames.shared and map_frames.max_bytes is not None and \
+                    map_frames.nbytes + sizeof(frame) > map_frames.max_bytes:
+                return
+            map_frames.set(key, frame)
+
+if os.environ.get('MAP_FRAME_WARMUP'):
+    threading.Thread(target=warm_map_frames, daemon=True).start()
+
+# views whose markers are clustered into grid cells until zoomed in: what a marker is, and the
+# centre (lon, lat) and half the width and height in degrees of the map at the default zoom
+clustered_views = {'United States': ('counties', (-96.0, 38.0), 30.0, 13.0)}
+
+# zoom (projection scale) from which single markers are shown, for the visible part of the map only
+MARKER_DETAIL_SCALE = float(os.environ.get('MARKER_DETAIL_SCALE', 4))
+# grid cell size in degrees at the default zoom, halved with each doubling of the zoom
+CLUSTER_CELL_DEGREES = float(os.environ.get('CLUSTER_CELL_DEGREES', 2))
+
+def clustered_frame(frame, view, relayout, sizeref):
+    '''
+    reduces a map frame to the markers in the visible part of the map once zoomed in, or to grid
+    cells summing them otherwise; returns the frame and the marker size reference and hover
+    template to draw it with
+    '''
+    unit, center, half_width, half_height = clustered_views[view]
+    relayout = relayout or {}
+    scale = float(relayout.get('geo.projection.scale') or 1)
+    center = (float(relayout.get('geo.center.lon', center[0])), float(relayout.get('geo.center.lat', center[1])))
+    if scale >= MARKER_DETAIL_SCALE:
+        # a margin around the visible part keeps markers in view when panning a little
+        visible = within(frame['lon'], frame['lat'], center, 1.5 * half_width / scale, 1.5 * half_height / scale)
+        return {key: values[visible] for key, values in frame.items()}, sizeref, marker_hover
+    # the grid changes in steps, so small zoom changes keep the same cells
+    cell = CLUSTER_CELL_DEGREES / 2 ** np.floor(np.log2(max(scale, 1)))
+    cells = aggregate_cells(frame['lon'], frame['lat'], frame['confirmed'], frame['color'], cell)
+    # cells holding a single marker keep its name
+    label = np.where(cells['points'] == 1, frame['label'][cells['first']],
+                     np.char.add(cells['points'].astype(str), ' ' + unit).astype(object))
+    # a cell's size is the square root of the summed count, so with the view's sizeref its area is
+    # the total area of the markers in it
+    return {'lon': cells['lon'],
+            'lat': cells['lat'],
+            'size': np.sqrt(cells['count']),
+            'color': cells['share'],
+            'confirmed': cells['count'],
+            'label': label,
+            'change': cells['share']}, sizeref, cell_hover
 
 @app.callback(
     Output('world_map', 'figure'),
     [Input('global_format', 'value'),
-     Input('date_slider', 'value')])
-def world_map(view, date_index):
+     Input('date_slider', 'value'),
+     Input('world_map', 'relayoutData')])
+def world_map(view, date_index, relayout):
     '''
     creates the lower-left chart (map)
     '''
-    if view == 'Worldwide':
-        df = df_worldwide
-        scope = 'world'
-        projection_type = 'natural earth'
-        sizeref = 35
-    elif view == 'United States':
-        scope = 'usa'
-        projection_type = 'albers usa'
-        df = df_us_counties
-        sizeref = 7
-    elif view == 'Europe':
-        df = df_eu
-        scope = 'europe'
-        projection_type = 'natural earth'
-        sizeref = 15
-    elif view == 'China':
-        df = df_china
-        scope = 'asia'
-        projection_type = 'natural earth'
-        sizeref = 3
-    else:
-        df = df_worldwide
-        scope = 'world'
-        projection_type = 'natural earth',
-        sizeref = 10
-    df = df[(df['date'] == df['date'].unique()[date_index]) & (df['Confirmed'] > 0)]
-    return {
-            'data': [
-                go.Scattergeo(
-                    lon = df['Longitude'],
-                    lat = df['Latitude'],
-                    text = df['Country/Region'] + ': ' +\
-                        ['{:,}'.format(i) for i in df['Confirmed']] +\
-                        ' total cases, ' + df['percentage'] +\
-                        '% from previous week',
-                    hoverinfo = 'text',
-                    mode = 'markers',
-                    marker = dict(reversescale = False,
-                        autocolorscale = False,
-                        symbol = 'circle',
-                        size = np.sqrt(df['Confirmed']),
-                        sizeref = sizeref,
-                        sizemin = 0,
-                        line = dict(width=.5, color='rgba(0, 0, 0)'),
-                        colorscale = 'Reds',
-                        cmin = 0,
-                        color = df['share_of_last_week'],
-                        cmax = 100,
-                        colorbar = dict(
-                            title = "Percentage of<br>cases occurring in<br>the previous week",
-                            thickness = 30)
-                        )
-                    )
-            ],
-            'layout': go.Layout(
-                title ='Number of Cumulative Confirmed Cases (size of marker)<br>and Share of New Cases from the Previous Week (color)',
-                geo=dict(scope=scope,
-                        projection_type=projection_type,
-                        showland = True,
-                        landcolor = "rgb(100, 125, 100)",
-                        showocean = True,
-                        oceancolor = "rgb(80, 150, 250)",
-                        showcountries=True,
-                        showlakes=True),
-                font=dict(color=dash_colors['text']),
-                paper_bgcolor=dash_colors['background'],
-                plot_bgcolor=dash_colors['background']
-            )
-        }
+    if view not in map_views:
+        view = 'Worldwide'
+    _, scope, projection_type, sizeref = map_views[view]
+    hover = marker_hover
+    with phase('data'):
+        frame = get_map_frame(data, view, date_index)
+        if view in clustered_views:
+            frame, sizeref, hover = clustered_frame(frame, view, relayout, sizeref)
+        # the change is shown to one decimal, so the longer digits are not sent
+        customdata = np.column_stack([frame['confirmed'], np.round(frame['change'].astype(float), 1)])
+    return figure([{'type': 'scattergeo',
+                    'lon': frame['lon'],
+                    'lat': frame['lat'],
+                    'text': frame['label'],
+                    'customdata': customdata,
+                    'hovertemplate': hover,
+                    'mode': 'markers',
+                    'marker': {'reversescale': False,
+                               'autocolorscale': False,
+                               'symbol': 'circle',
+                               'size': frame['size'],
+                               'sizeref': sizeref,
+                               'sizemin': 0,
+                               'line': {'width': .5, 'color': 'rgba(0, 0, 0)'},
+                               'colorscale': map_colorscale,
+                               'cmin': 0,
+                               'color': frame['color'],
+                               'cmax': 100,
+                               'colorbar': {'title': title("Percentage of<br>cases occurring in<br>the previous week"),
+                                            'thickness': 30}}}],
+                  {'title': title('Number of Cumulative Confirmed Cases (size of marker)<br>and Share of New Cases from the Previous Week (color)'),
+                   'geo': {'scope': scope,
+                           'projection': {'type': projection_type},
+                           'showland': True,
+                           'landcolor': "rgb(100, 125, 100)",
+                           'showocean': True,
+                           'oceancolor': "rgb(80, 150, 250)",
+                           'showcountries': True,
+                           'showlakes': True},
+                   'font': {'color': dash_colors['text']},
+                   'paper_bgcolor': dash_colors['background'],
+                   'plot_bgcolor': dash_colors['background'],
+                   # keeps the user's zoom when the markers for it arrive
+                   'uirevision': view})
 
 def hex_to_rgba(h, alpha=1):
     '''
@@ -474,172 +762,389 @@ def hex_to_rgba(h, alpha=1):
     '''
     return tuple([int(h.lstrip('#')[i:i+2], 16) for i in (0, 2, 4)] + [alpha])
 
-@app.callback(
-    Output('trajectory', 'figure'),
-    [Input('global_format', 'value'),
-     Input('date_slider', 'value')])
-def trajectory(view, date_index):
+# the chart shows the date selected on the slider; TRAJECTORY_ANIMATED=1 ships every date as an
+# animation instead, which is sent again in full on each slider move
+TRAJECTORY_ANIMATED = os.environ.get('TRAJECTORY_ANIMATED', '0') == '1'
+
+trajectory_figures = make_cache('trajectory_figures', max_items=64)
+
+def build_trajectory_figure(state, date):
     '''
-    creates the lower-right chart (trajectory)
+    builds the choropleth of cumulative cases, animated over every date or for a single date
     '''
-    return px.choropleth(df_master,                            # Input Dataframe
+    who = state['who']
+    positions = slice(None) if date is None else slice(who['dates'].index(date), who['dates'].index(date) + 1)
+    # long-form rows of the reports, country by country, rebuilt from the aggregates only for this chart
+    columns, rows = np.nonzero(who['reported'][positions].T)
+    df = pd.DataFrame({'Date_reported': np.array(who['dates'][positions], dtype=object)[rows],
+                       'Country': np.array(who['countries'], dtype=object)[columns],
+                       'iso_alpha_3': state['iso_alpha_3'][columns],
+                       'Cumulative_cases': who['values']['Cumulative_cases'][positions][rows, columns].astype(np.int64)})
+    animation_frame = "Date_reported" if date is None else None
+    return px.choropleth(df,                            # Input Dataframe
                      locations="iso_alpha_3",           # identify country code column
                      color="Cumulative_cases",                     # identify representing column
                      hover_name="Country",              # identify hover name
-                     animation_frame="Date_reported",        # identify date column
+                     animation_frame=animation_frame,        # identify date column
                      projection="natural earth",        # select projection
                      color_continuous_scale = 'Peach',  # select prefer color scale
                      range_color=[0,5000000]              # select range of dataset
-                     )
-
-
-app.layout = html.Div(style={'backgroundColor': dash_colors['background']}, children=[
-    html.H1(children='COVID-19 Analysis Dashboard',
-        style={
-            'textAlign': 'center',
-            'color': dash_colors['text']
-            }
-        ),
-
-    html.Div(dcc.Graph(id='confirmed_ind'),
-        style={
-            'textAlign': 'center',
-            'color': dash_colors['red'],
-            'width': '25%',
-            'float': 'left',
-            'display': 'inline-block'
-            }
-        ),
-
-    html.Div(dcc.Graph(id='active_ind'),
-        style={
-            'textAlign': 'center',
-            'color': dash_colors['red'],
-
-            'width': '25%',
-            'float': 'left',
-            'display': 'inline-block'
-            }
-        ),
-
-    html.Div(dcc.Graph(id='deaths_ind'),
-        style={
-            'textAlign': 'center',
-            'color': dash_colors['red'],
-            'width': '25%',
-            'float': 'left',
-            'display': 'inline-block'
-            }
-        ),
-
-    html.Div(dcc.Graph(id='recovered_ind'),
-        style={
-            'textAlign': 'center',
-            'color': dash_colors['red'],
-            'width': '25%',
-            'float': 'left',
-            'display': 'inline-block'
-            }
-        ),
-html.Div(dcc.Dropdown(
-        id='demo-dropdown',
-        options=[{'label':i,'value':i} for i in df_master['Country'].unique()]+['label:Worldwide,value:Worldwide'],value='Worldwide'
-    )),
-html.Div(dcc.RadioItems(id='global_format',
-            options=[{'label': i, 'value': i} for i in ['Worldwide', 'United States', 'Europe', 'China']],
-            value='Worldwide',
-            labelStyle={'float': 'center', 'display': 'inline-block'}
-            ), style={'textAlign': 'center',
-                'color': dash_colors['text'],
-                'width': '100%',
-                'float': 'center',
+                     ).to_dict()
+
+def get_trajectory_figure(state, date):
+    '''
+    returns the trajectory figure for a date (None for the animation), built once per data version
+    '''
+    key = (state['version'], date)
+    figure = trajectory_figures.get(key)
+    if figure is None:
+        figure = build_trajectory_figure(state, date)
+        trajectory_figures.set(key, figure)
+    return figure
+
+@app.callback(
+    Output('trajectory', 'figure'),
+    [Input('global_format', 'value'),
+     Input('date_slider', 'value')])
+def trajectory(view, date_index):
+    '''
+    creates the lower-right chart (trajectory)
+    '''
+    state = data
+    if TRAJECTORY_ANIMATED:
+        return get_trajectory_figure(state, None)
+    # the slider runs over the dates of df_worldwide; show the latest WHO report on or before that date
+    slider_date = pd.Timestamp(view_tables(state, 'Worldwide')['map_dates'][date_index]).strftime('%Y-%m-%d')
+    position = max(bisect_right(state['trajectory_dates'], slider_date) - 1, 0)
+    return get_trajectory_figure(state, state['trajectory_dates'][position])
+
+# responses of these callbacks depend only on their inputs and the data version
+response_cache = install_response_cache(server,
+                                        ['worldwide_trend.figure', 'active_countries.figure',
+                                         'world_map.figure', 'trajectory.figure'],
+                                        lambda: data['version'],
+                                        max_age=int(os.environ.get('RESPONSE_MAX_AGE', 300)),
+                                        cache=make_cache('responses', max_bytes=int(os.environ.get('RESPONSE_CACHE_BYTES', 64 * 2**20))),
+                                        layout=True)
+
+# caches holding results derived from a specific data version; the in-process ones are emptied after each refresh
+data_caches = [region_series, map_frames, trajectory_figures, response_cache]
+
+def callback_request(output, inputs):
+    '''
+    builds a _dash-update-component request body the way the browser sends it
+    '''
+    outputs = [{'id': component, 'property': prop}
+               for component, prop in (item.split('.') for item in output.strip('.').split('...'))]
+    return {'output': output,
+            'outputs': outputs if len(outputs) > 1 else outputs[0],
+            'inputs': [{'id': i, 'property': p, 'value': value} for i, p, value in inputs],
+            'changedPropIds': [],
+            'state': []}
+
+def default_requests(state):
+    '''
+    lists the chart requests a new visitor's page makes, for the default state of every loaded view
+    '''
+    requests = [callback_request('worldwide_trend.figure', [('demo-dropdown', 'value', 'Worldwide'),
+                                                            ('resolution_select', 'value', 'daily'),
+                                                            ('population_select', 'value', 'absolute'),
+                                                            ('worldwide_trend', 'relayoutData', None)])]
+    last_date = len(view_tables(state, 'Worldwide')['map_dates']) - 1
+    for view in [view for view, handle in state['views'].items() if handle.loaded]:
+        requests.append(callback_request('active_countries.figure',
+                                         [('global_format', 'value', view),
+                                          ('country_select', 'value', default_selection(view)),
+                                          ('column_select', 'value', 'Confirmed'),
+                                          ('population_select', 'value', 'absolute'),
+                                          ('resolution_select', 'value', 'daily'),
+                                          ('active_countries', 'relayoutData', None)]))
+        requests.append(callback_request('world_map.figure', [('global_format', 'value', view),
+                                                              ('date_slider', 'value', last_date),
+                                                              ('world_map', 'relayoutData', None)]))
+        requests.append(callback_request('trajectory.figure', [('global_format', 'value', view),
+                                                               ('date_slider', 'value', last_date)]))
+    return requests
+
+def warm_default_responses():
+    '''
+    renders the page layout and the default-view responses through the server once, so they sit
+    pre-serialized and compressed in the response cache before the first visitor asks for them
+    '''
+    client = server.test_client()
+    try:
+        client.get('/_dash-layout', headers={'Accept-Encoding': 'br, gzip'})
+    except Exception:
+        logger.exception('warming the layout failed')
+    for body in default_requests(data):
+        try:
+            client.post('/_dash-update-component', json=body, headers={'Accept-Encoding': 'br, gzip'})
+        except Exception:
+            logger.exception('warming %s failed', body['output'])
+
+refresh_lock = threading.Lock()
+
+def refresh_data():
+    '''
+    loads the rows added to the data files since the last load, rebuilds the derived tables off to
+    the side and swaps them in with a single assignment; requests in flight keep using the tables
+    they started with
+    '''
+    global data
+    with refresh_lock:
+        version = source_version()
+        if version == data['version']:
+            return False
+        loaded_views = [view for view, handle in data['views'].items() if handle.loaded]
+        view_frames = {}
+        if SHARED_DATA_DIR:
+            frames = load_datasets(eager_datasets)
+        else:
+            # the datasets of the loaded views get their new rows too, and unchanged ones are reused
+            for view in loaded_views:
+                view_frames.update(data['views'][view].get()['frames'])
+            frames = refresh_frames(dict(view_frames, **data['frames']), data['signatures'])
+            view_frames = {name: frames.pop(name) for name in list(frames) if name not in data['frames']}
+        # the WHO file is streamed again as a whole, and only when it changed
+        who = data['who'] if file_signatures()['master'] == data['signatures']['master'] else load_who()
+        state = build_data(frames, who, version, view_frames)
+        # views in use are rebuilt before the swap, so their visitors do not wait for the reload
+        for view in loaded_views:
+            state['views'][view].get()
+        data = state
+        # shared caches are left to other workers still on the old version; its entries age out
+        for cache in data_caches:
+            if not cache.shared:
+                cache.clear()
+        logger.info('data refreshed to version %s', version)
+    if DEFAULT_VIEW_WARMUP:
+        warm_default_responses()
+    return True
+
+def poll_data(interval):
+    '''
+    checks the data files for changes every interval seconds
+    '''
+    while True:
+        time.sleep(interval)
+        try:
+            refresh_data()
+        except Exception:
+            logger.exception('data refresh failed')
+
+def unload_idle_views(interval):
+    '''
+    drops the tables of regional views that have not been used for VIEW_IDLE_SECONDS
+    '''
+    while True:
+        time.sleep(interval)
+        for view, handle in data['views'].items():
+            if handle.unload_if_idle():
+                logger.info('%s view unloaded after %.0f s idle', view, VIEW_IDLE_SECONDS)
+
+if VIEW_IDLE_SECONDS > 0:
+    threading.Thread(target=unload_idle_views, args=(min(VIEW_IDLE_SECONDS, 60),), daemon=True).start()
+
+# DATA_REFRESH_SECONDS enables polling the data directory for new daily files
+if float(os.environ.get('DATA_REFRESH_SECONDS', 0)) > 0:
+    threading.Thread(target=poll_data, args=(float(os.environ['DATA_REFRESH_SECONDS']),), daemon=True).start()
+
+def build_layout(state):
+    '''
+    builds the page layout from a data version, with its dropdown, slider range and page bundle
+    '''
+    countries = state['who']['countries']
+    df_worldwide = state['frames']['worldwide']
+    return html.Div(style={'backgroundColor': dash_colors['background']}, children=[
+        html.H1(children='COVID-19 Analysis Dashboard',
+            style={
+                'textAlign': 'center',
+                'color': dash_colors['text']
+                }
+            ),
+
+        html.Div(dcc.Graph(id='confirmed_ind'),
+            style={
+                'textAlign': 'center',
+                'color': dash_colors['red'],
+                'width': '25%',
+                'float': 'left',
                 'display': 'inline-block'
-            }
-        ),
-
-    html.Div(dcc.RadioItems(id='population_select',
-            options=[{'label': 'Total values', 'value': 'absolute'},
-                        {'label': 'Values per 100,000 of population', 'value': 'percent'}],
-            value='absolute',
-            labelStyle={'float': 'center', 'display': 'inline-block'},
-            style={'textAlign': 'center',
-                'color': dash_colors['text'],
-                'width': '100%',
-                'float': 'center',
+                }
+            ),
+
+        html.Div(dcc.Graph(id='active_ind'),
+            style={
+                'textAlign': 'center',
+                'color': dash_colors['red'],
+
+                'width': '25%',
+                'float': 'left',
+                'display': 'inline-block'
+                }
+            ),
+
+        html.Div(dcc.Graph(id='deaths_ind'),
+            style={
+                'textAlign': 'center',
+                'color': dash_colors['red'],
+                'width': '25%',
+                'float': 'left',
+                'display': 'inline-block'
+                }
+            ),
+
+        html.Div(dcc.Graph(id='recovered_ind'),
+            style={
+                'textAlign': 'center',
+                'color': dash_colors['red'],
+                'width': '25%',
+                'float': 'left',
                 'display': 'inline-block'
-                })
-        ),
-
-    html.Div(  # worldwide_trend and active_countries
-        [
-            html.Div(
-                dcc.Graph(id='worldwide_trend'),
-                style={'width': '50%', 'float': 'left', 'display': 'inline-block'}
-                ),
-            html.Div([
-                dcc.Graph(id='active_countries'),
+                }
+            ),
+    # the lookups the indicators and region drop-down are answered from in the browser
+    dcc.Store(id='dashboard_bundle', data=page_bundle(state)),
+    html.Div(dcc.Dropdown(
+            id='demo-dropdown',
+            options=[{'label':i,'value':i} for i in countries]+['label:Worldwide,value:Worldwide'],value='Worldwide'
+        )),
+    html.Div(dcc.RadioItems(id='delta_reference',
+                options=[{'label': 'Change from previous day', 'value': 'day'},
+                         {'label': 'Change from previous week', 'value': 'week'}],
+                value='day',
+                labelStyle={'float': 'center', 'display': 'inline-block'}
+                ), style={'textAlign': 'center',
+                    'color': dash_colors['text'],
+                    'width': '100%',
+                    'float': 'center',
+                    'display': 'inline-block'
+                }
+            ),
+    html.Div(dcc.RadioItems(id='global_format',
+                options=[{'label': i, 'value': i} for i in ['Worldwide', 'United States', 'Europe', 'China']],
+                value='Worldwide',
+                labelStyle={'float': 'center', 'display': 'inline-block'}
+                ), style={'textAlign': 'center',
+                    'color': dash_colors['text'],
+                    'width': '100%',
+                    'float': 'center',
+                    'display': 'inline-block'
+                }
+            ),
+
+        html.Div(dcc.RadioItems(id='population_select',
+                options=[{'label': 'Total values', 'value': 'absolute'},
+                            {'label': 'Values per 100,000 of population', 'value': 'percent'}],
+                value='absolute',
+                labelStyle={'float': 'center', 'display': 'inline-block'},
+                style={'textAlign': 'center',
+                    'color': dash_colors['text'],
+                    'width': '100%',
+                    'float': 'center',
+                    'display': 'inline-block'
+                    })
+            ),
+
+        html.Div(  # worldwide_trend and active_countries
+            [
                 html.Div([
+                    dcc.Graph(id='worldwide_trend'),
                     dcc.RadioItems(
-                        id='column_select',
-                        options=[{'label': i, 'value': i} for i in ['Confirmed', 'Deaths']],
-                        value='Confirmed',
+                        id='resolution_select',
+                        options=[{'label': 'Daily', 'value': 'daily'},
+                                 {'label': 'Weekly', 'value': 'weekly'}],
+                        value='daily',
                         labelStyle={'float': 'center', 'display': 'inline-block'},
                         style={'textAlign': 'center',
                             'color': dash_colors['text'],
                             'width': '100%',
                             'float': 'center',
                             'display': 'inline-block'
-                            }),
-                    dcc.Dropdown(
-                        id='country_select',
-                        multi=True,
-                        style={'width': '95%', 'float': 'center'}
-                        )],
-                    style={'width': '100%', 'float': 'center', 'display': 'inline-block'})
-                ],
-                style={'width': '50%', 'float': 'right', 'vertical-align': 'bottom'}
-            )],
-        style={'width': '98%', 'float': 'center', 'vertical-align': 'bottom'}
-        ),
-
-    html.Div(dcc.Markdown(' '),
-        style={
-            'textAlign': 'center',
-            'color': dash_colors['text'],
-            'width': '100%',
-            'float': 'center',
-            'display': 'inline-block'}),
-
-    html.Div(dcc.Graph(id='world_map'),
-        style={'width': '50%',
-            'display': 'inline-block'}
-        ),
-
-    html.Div([dcc.Graph(id='trajectory')],
-        style={'width': '50%',
-            'float': 'right',
-            'display': 'inline-block'}),
-
-    html.Div(html.Div(dcc.Slider(id='date_slider',
-                min=list(range(len(df_worldwide['date'].unique())))[0],
-                max=list(range(len(df_worldwide['date'].unique())))[-1],
-                value=list(range(len(df_worldwide['date'].unique())))[-1],
-                # marks={(idx): {'label': date.format(u"\u2011", u"\u2011") if
-                #     (idx-4)%7==0 else '', 'style':{'transform': 'rotate(30deg) translate(0px, 7px)'}} for idx, date in
-                #     enumerate(sorted(set([item.strftime("%m{}%d{}%Y") for
-                #     item in df_worldwide['date']])))},  # for weekly marks,
-                marks={(idx): {'label': date.format(u"\u2011", u"\u2011") if
-                    date[4:6] in ['01', '15'] else '', 'style':{'transform': 'rotate(30deg) translate(0px, 7px)'}} for idx, date in
-                    enumerate(sorted([item.strftime("%m{}%d{}%Y") for
-                    item in pd.Series(df_worldwide['date'].unique())],
-                    key=lambda date: datetime.strptime(date, '%m{}%d{}%Y')))},  # for bi-monthly marks
-                step=1,
-                vertical=False,
-                updatemode='mouseup'),
-            style={'width': '94.74%', 'float': 'left'}),  # width = 1 - (100 - x) / x
-        style={'width': '95%', 'float': 'right'}),  # width = x
-
-        ])
+                            })],
+                    style={'width': '50%', 'float': 'left', 'display': 'inline-block'}
+                    ),
+                html.Div([
+                    dcc.Graph(id='active_countries'),
+                    html.Div([
+                        dcc.RadioItems(
+                            id='column_select',
+                            options=[{'label': i, 'value': i} for i in ['Confirmed', 'Deaths'] + list(derived_metrics)],
+                            value='Confirmed',
+                            labelStyle={'float': 'center', 'display': 'inline-block'},
+                            style={'textAlign': 'center',
+                                'color': dash_colors['text'],
+                                'width': '100%',
+                                'float': 'center',
+                                'display': 'inline-block'
+                                }),
+                        dcc.Dropdown(
+                            id='country_select',
+                            multi=True,
+                            style={'width': '95%', 'float': 'center'}
+                            )],
+                        style={'width': '100%', 'float': 'center', 'display': 'inline-block'})
+                    ],
+                    style={'width': '50%', 'float': 'right', 'vertical-align': 'bottom'}
+                )],
+            style={'width': '98%', 'float': 'center', 'vertical-align': 'bottom'}
+            ),
+
+        html.Div(dcc.Markdown(' '),
+            style={
+                'textAlign': 'center',
+                'color': dash_colors['text'],
+                'width': '100%',
+                'float': 'center',
+                'display': 'inline-block'}),
+
+        html.Div(dcc.Graph(id='world_map'),
+            style={'width': '50%',
+                'display': 'inline-block'}
+            ),
+
+        html.Div([dcc.Graph(id='trajectory')],
+            style={'width': '50%',
+                'float': 'right',
+                'display': 'inline-block'}),
+
+        html.Div(html.Div(dcc.Slider(id='date_slider',
+                    min=list(range(len(df_worldwide['date'].unique())))[0],
+                    max=list(range(len(df_worldwide['date'].unique())))[-1],
+                    value=list(range(len(df_worldwide['date'].unique())))[-1],
+                    # marks={(idx): {'label': date.format(u"\u2011", u"\u2011") if
+                    #     (idx-4)%7==0 else '', 'style':{'transform': 'rotate(30deg) translate(0px, 7px)'}} for idx, date in
+                    #     enumerate(sorted(set([item.strftime("%m{}%d{}%Y") for
+                    #     item in df_worldwide['date']])))},  # for weekly marks,
+                    marks={(idx): {'label': date.format(u"\u2011", u"\u2011") if
+                        date[4:6] in ['01', '15'] else '', 'style':{'transform': 'rotate(30deg) translate(0px, 7px)'}} for idx, date in
+                        enumerate(sorted([item.strftime("%m{}%d{}%Y") for
+                        item in pd.Series(df_worldwide['date'].unique())],
+                        key=lambda date: datetime.strptime(date, '%m{}%d{}%Y')))},  # for bi-monthly marks
+                    step=1,
+                    vertical=False,
+                    updatemode='mouseup'),
+                style={'width': '94.74%', 'float': 'left'}),  # width = 1 - (100 - x) / x
+            style={'width': '95%', 'float': 'right'}),  # width = x
+
+            ])
+
+def serve_layout():
+    '''
+    returns the page layout of the current data, built for the first page served from each data
+    version, so new visitors get the refreshed dropdown and slider range
+    '''
+    state = data
+    if 'layout' not in state:
+        state['layout'] = build_layout(state)
+    return state['layout']
+
+app.layout = serve_layout
+
+# DEFAULT_VIEW_WARMUP=0 skips pre-rendering the default view responses at startup
+DEFAULT_VIEW_WARMUP = os.environ.get('DEFAULT_VIEW_WARMUP', '1') != '0'
+if DEFAULT_VIEW_WARMUP:
+    threading.Thread(target=warm_default_responses, daemon=True).start()
 
 if __name__ == '__main__':
     app.run_server(debug=False)
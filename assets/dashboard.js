@@ -0,0 +1,49 @@
+// clientside callbacks of the controls that only look up static tables; the tables come in the
+// bundle app.py sends with the page (the dashboard_bundle store), so these never reach the server
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        // the four indicators for a country, with the change from the reference report, per
+        // 100,000 of population when selected and the country has a population
+        indicator_strip: function (view, reference, population, bundle) {
+            var mode = population === 'percent' && bundle.snapshots.percent.latest.hasOwnProperty(view) ? 'percent' : 'absolute';
+            var snapshots = bundle.snapshots[mode];
+            var format = bundle.formats[mode];
+            var zeros = bundle.titles.map(function () { return 0; });
+            var values = snapshots.latest.hasOwnProperty(view) ? snapshots.latest[view] : zeros;
+            var references = null;
+            if (reference !== 'latest' && snapshots.hasOwnProperty(reference)) {
+                references = snapshots[reference].hasOwnProperty(view) ? snapshots[reference][view] : zeros;
+            }
+            return bundle.titles.map(function (title, i) {
+                var figure = JSON.parse(JSON.stringify(bundle.indicator));
+                var indicator = figure.data[0];
+                indicator.value = values[i];
+                indicator.number.valueformat = format[0];
+                if (references === null) {
+                    indicator.mode = 'number';
+                    delete indicator.delta;
+                } else {
+                    indicator.delta.reference = references[i];
+                    indicator.delta.valueformat = format[0];
+                }
+                figure.layout.title.text = title + format[1];
+                return figure;
+            });
+        },
+
+        // allowable options for regions in the upper-right chart drop-down
+        set_active_options: function (view, bundle) {
+            if (!bundle.region_options.hasOwnProperty(view)) {
+                return window.dash_clientside.no_update;
+            }
+            return bundle.region_options[view].map(function (region) {
+                return {label: region, value: region};
+            });
+        },
+
+        // default selections for regions in the upper-right chart drop-down
+        set_countries_value: function (view, options, bundle) {
+            return bundle.default_regions.hasOwnProperty(view) ? bundle.default_regions[view] : bundle.fallback_regions;
+        }
+    }
+});
@@ -0,0 +1,234 @@
+'''
+benchmarks the dashboard callbacks against synthetic data of a configurable size
+
+    python benchmark.py --countries 200 --days 700 --counties 3000 --save baseline.json
+    python benchmark.py --countries 200 --days 700 --counties 3000 --compare baseline.json
+
+the data is generated in WHO and regional CSV formats into a temporary directory (or --data-dir),
+app.py is imported against it and every callback is timed over a spread of inputs
+'''
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# names the dashboard selects by default, so the default views have data to plot
+default_countries = ['US', 'Italy', 'United Kingdom', 'Spain', 'Russia', 'Brazil', 'Sweden',
+                     'Belgium', 'Peru', 'India', 'Lithuania', 'France', 'Germany']
+default_states = ['New York', 'New Jersey', 'California', 'Texas', 'Florida', 'Mississippi',
+                  'Arizona', 'Louisiana', 'Colorado']
+default_eu = ['France', 'Germany', 'Italy', 'Spain', 'United Kingdom', 'Belgium', 'Sweden', 'Lithuania']
+default_china = ['Hubei', 'Guangdong', 'Xinjiang', 'Zhejiang', 'Hunan', 'Hong Kong', 'Macau']
+
+
+def region_names(defaults, count, prefix):
+    return defaults + ['{} {:05d}'.format(prefix, i) for i in range(count - len(defaults))]
+
+def shifted(values, days):
+    '''
+    returns values delayed by days along the date axis, zero-filled
+    '''
+    result = np.zeros_like(values)
+    result[days:] = values[:len(values) - days]
+    return result
+
+def synthetic_counts(rng, regions, days):
+    '''
+    returns cumulative confirmed and death counts of shape (days, regions)
+    '''
+    rate = rng.uniform(1, 500, size=regions)
+    new_cases = rng.poisson(rate, size=(days, regions))
+    new_deaths = rng.binomial(new_cases, 0.02)
+    return np.cumsum(new_cases, axis=0), np.cumsum(new_deaths, axis=0)
+
+def write_who(path, rng, countries, dates):
+    confirmed, deaths = synthetic_counts(rng, len(countries), len(dates))
+    new_cases = np.diff(confirmed, axis=0, prepend=0)
+    new_deaths = np.diff(deaths, axis=0, prepend=0)
+    # the WHO file is ordered by country, then date
+    pd.DataFrame({'Date_reported': np.tile(dates, len(countries)),
+                  'Country_code': np.repeat(['{:02d}'.format(i % 100) for i in range(len(countries))], len(dates)),
+                  'Country': np.repeat(countries, len(dates)),
+                  'WHO_region': 'EURO',
+                  'New_cases': new_cases.T.ravel(),
+                  'Cumulative_cases': confirmed.T.ravel(),
+                  'New_deaths': new_deaths.T.ravel(),
+                  'Cumulative_deaths': deaths.T.ravel()}).to_csv(path, index=False)
+
+def regional_frame(rng, regions, dates, missing_population=()):
+    confirmed, deaths = synthetic_counts(rng, len(regions), len(dates))
+    last_week = shifted(confirmed, 7)
+    previous_week = shifted(confirmed, 14)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.nan_to_num(100 * (confirmed - last_week) / confirmed)
+        percentage = np.nan_to_num(100 * ((confirmed - last_week) / (last_week - previous_week) - 1), posinf=0.0, neginf=0.0)
+    population = rng.uniform(0.5, 500, size=len(regions))
+    population[[regions.index(name) for name in missing_population]] = np.nan
+    # regional files are ordered by date, then region
+    return pd.DataFrame({'date': np.repeat(dates, len(regions)),
+                         'Country/Region': np.tile(regions, len(dates)),
+                         'Latitude': np.tile(rng.uniform(25, 50, size=len(regions)), len(dates)).round(4),
+                         'Longitude': np.tile(rng.uniform(-125, -65, size=len(regions)), len(dates)).round(4),
+                         'Confirmed': confirmed.ravel(),
+                         'Deaths': deaths.ravel(),
+                         'Recovered': 0,
+                         'Active': (confirmed - deaths).ravel(),
+                         'share_of_last_week': share.ravel().round(2),
+                         'percentage': percentage.ravel().round(1),
+                         'population': np.tile(population, len(dates))})
+
+def generate(data_dir, countries=200, days=365, counties=3000, seed=0):
+    '''
+    writes a complete synthetic data directory in the formats the dashboard reads
+    '''
+    os.makedirs(data_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-01-22', periods=days).strftime('%Y-%m-%d').to_numpy()
+    names = region_names(default_countries, countries, 'Country')
+    write_who(os.path.join(data_dir, 'WHO-COVID-19-global-data.csv'), rng, names, dates)
+    regional_frame(rng, names + ['Recovered'], dates, ['Recovered']).to_csv(os.path.join(data_dir, 'df_worldwide.csv'), index=False)
+    regional_frame(rng, region_names(default_states, 51, 'State'), dates).to_csv(os.path.join(data_dir, 'df_us.csv'), index=False)
+    regional_frame(rng, region_names(default_eu, 46, 'Nation'), dates).to_csv(os.path.join(data_dir, 'df_eu.csv'), index=False)
+    regional_frame(rng, region_names(default_china, 33, 'Province'), dates).to_csv(os.path.join(data_dir, 'df_china.csv'), index=False)
+    df = regional_frame(rng, ['{:05d}'.format(1000 + i) for i in range(counties)], dates)
+    for i, part in enumerate(np.array_split(np.arange(len(df)), 4)):
+        df.iloc[part].to_csv(os.path.join(data_dir, 'df_us_county{}.csv'.format(i + 1)), index=False)
+
+def cases(app, rng, samples):
+    '''
+    lists (callback name, function, arguments) covering each callback over varied inputs
+    '''
+    views = ['Worldwide', 'United States', 'Europe', 'China']
+    countries = ['Worldwide'] + default_countries
+    slider_length = len(app.view_tables(app.data, 'Worldwide')['map_dates'])
+    result = []
+    for i in range(samples):
+        view = views[i % len(views)]
+        country = countries[i % len(countries)]
+        date_index = int(rng.integers(slider_length))
+        # the indicators are looked up in the browser, from a bundle the server builds per data version
+        result.append(('indicator_bundle', app.build_bundle, (app.data,)))
+        result.append(('worldwide_trend', app.worldwide_trend, (country, ['daily', 'weekly'][(i // 2) % 2], ['absolute', 'percent'][(i // 4) % 2], None)))
+        result.append(('active_countries', app.active_countries,
+                       (view, app.default_selection(view), ['Confirmed', 'Deaths'][i % 2],
+                        ['absolute', 'percent'][(i // 2) % 2], ['daily', 'weekly'][(i // 4) % 2], None)))
+        result.append(('world_map', app.world_map, (view, date_index, None)))
+        result.append(('trajectory', app.trajectory, (view, date_index)))
+    return result
+
+def run(app, samples=50, seed=0):
+    '''
+    times every callback cold, with every cache emptied first, and again warm right after, and
+    measures its peak traced memory and JSON payload size
+    '''
+    from plotly.io.json import to_json_plotly
+
+    timings, warm, payloads, first = {}, {}, {}, {}
+    for name, function, args in cases(app, np.random.default_rng(seed), samples):
+        for cache in app.data_caches:
+            cache.clear()
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        first.setdefault(name, elapsed)
+        timings.setdefault(name, []).append(elapsed)
+        start = time.perf_counter()
+        function(*args)
+        warm.setdefault(name, []).append(time.perf_counter() - start)
+        payloads.setdefault(name, []).append(len(to_json_plotly(result)))
+
+    # memory is measured on cold caches, so it covers building the result rather than a cache lookup
+    peaks = {}
+    for name, function, args in cases(app, np.random.default_rng(seed + 1), 1):
+        for cache in app.data_caches:
+            cache.clear()
+        tracemalloc.start()
+        function(*args)
+        peaks[name] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {name: {'calls': len(values),
+                   'first_ms': 1000 * first[name],
+                   'p50_ms': 1000 * float(np.percentile(values, 50)),
+                   'p99_ms': 1000 * float(np.percentile(values, 99)),
+                   'warm_p50_ms': 1000 * float(np.percentile(warm[name], 50)),
+                   'peak_memory_bytes': peaks[name],
+                   'payload_bytes': int(np.mean(payloads[name]))}
+            for name, values in timings.items()}
+
+def report(results, baseline=None, threshold=1.25):
+    '''
+    prints the results, with the ratio to a baseline where one is given; returns the regressions.
+    p50 and p99 are cold (caches emptied before each call), warm p50 repeats the same call.
+    '''
+    regressions = []
+    print('{:<18}{:>10}{:>10}{:>10}{:>10}{:>14}{:>14}'.format('callback', 'first ms', 'p50 ms', 'p99 ms', 'warm ms',
+                                                            'peak KB', 'payload KB'))
+    for name, result in results['callbacks'].items():
+        line = '{:<18}{:>10.1f}{:>10.2f}{:>10.2f}{:>10.2f}{:>14.0f}{:>14.1f}'.format(
+            name, result['first_ms'], result['p50_ms'], result['p99_ms'], result.get('warm_p50_ms', float('nan')),
+            result['peak_memory_bytes'] / 1024, result['payload_bytes'] / 1024)
+        if baseline and name in baseline['callbacks']:
+            ratio = result['p50_ms'] / max(baseline['callbacks'][name]['p50_ms'], 1e-6)
+            line += '   x{:.2f} vs baseline'.format(ratio)
+            if ratio > threshold:
+                regressions.append(name)
+        print(line)
+    print('load {:.2f} s, max RSS {:.0f} MB'.format(results['load_seconds'], results['max_rss_bytes'] / 2**20))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the dashboard callbacks on synthetic data')
+    parser.add_argument('--countries', type=int, default=200)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--counties', type=int, default=3000)
+    parser.add_argument('--samples', type=int, default=50, help='calls per callback')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', help='reuse or keep the generated data in this directory')
+    parser.add_argument('--save', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', help='compare against a JSON baseline and fail on regressions')
+    parser.add_argument('--threshold', type=float, default=1.25, help='p50 slowdown counted as a regression')
+    args = parser.parse_args(argv)
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='covid-benchmark-')
+    if not os.path.exists(os.path.join(data_dir, 'WHO-COVID-19-global-data.csv')):
+        generate(data_dir, args.countries, args.days, args.counties, args.seed)
+
+    # app.py loads its data at import, so the data directory has to be set first
+    os.environ['DATA_DIR'] = data_dir
+    # callbacks are timed cold, without responses pre-rendered in the background
+    os.environ.setdefault('DEFAULT_VIEW_WARMUP', '0')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    import app
+    load_seconds = time.perf_counter() - start
+
+    results = {'parameters': {'countries': args.countries, 'days': args.days, 'counties': args.counties,
+                              'samples': args.samples, 'seed': args.seed},
+               'load_seconds': load_seconds,
+               'callbacks': run(app, args.samples, args.seed),
+               'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.threshold)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if regressions:
+        print('regressions: {}'.format(', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
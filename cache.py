@@ -0,0 +1,326 @@
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# CACHE_BACKEND chooses where make_cache keeps results: 'memory' (each process its own), 'disk'
+# (shared by the processes of a host) or 'redis' (shared by every host); the disk backend writes
+# under CACHE_DIR, kept out of the data directory so that one can be read-only
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'covid-dashboard-cache'))
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_TTL = int(os.environ.get('CACHE_TTL', 24 * 3600))
+
+logger = logging.getLogger(__name__)
+
+
+def sizeof(value):
+    '''
+    roughly estimates the memory held by a cached value (arrays, strings and containers of them)
+    '''
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return value.nbytes + sum(sizeof(item) for item in value)
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(sizeof(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(sizeof(item) for item in value)
+    return 8
+
+
+def key_digest(key):
+    '''
+    names a cache key in the shared backends; keys are tuples of plain values, so their repr is stable
+    '''
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+class LRUCache:
+    '''
+    thread-safe least-recently-used cache bounded by item count and estimated memory
+    '''
+    shared = False
+
+    def __init__(self, max_items=None, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def set(self, key, value):
+        size = sizeof(value)
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.nbytes += size
+            while self._items and ((self.max_items is not None and len(self._items) > self.max_items) or
+                                   (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.nbytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+class DiskCache:
+    '''
+    cache of pickled values in a directory, shared by the processes of a host; the least recently
+    used files are removed once the directory holds more than max_bytes. Errors reading or writing
+    the files count as misses.
+    '''
+    shared = True
+
+    def __init__(self, directory, max_bytes=256 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.nbytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def path(self, key):
+        return os.path.join(self.directory, key_digest(key))
+
+    def __len__(self):
+        try:
+            return sum(1 for entry in os.scandir(self.directory) if not entry.name.startswith('.'))
+        except OSError:
+            logger.warning('disk cache listing failed', exc_info=True)
+            return 0
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key, default=None):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        path = self.path(key)
+        # written under a temporary name and renamed, so readers never see a partial file
+        temporary = os.path.join(self.directory, '.{}.{}.{}'.format(os.path.basename(path), os.getpid(), threading.get_ident()))
+        try:
+            with open(temporary, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.nbytes += os.path.getsize(temporary)
+            os.replace(temporary, path)
+        except (OSError, pickle.PicklingError, TypeError, AttributeError):
+            logger.warning('disk cache write failed', exc_info=True)
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            return
+        if self.max_bytes is not None and self.nbytes > self.max_bytes:
+            self.prune()
+
+    def prune(self):
+        '''
+        removes the least recently used files until the directory is back under 90% of max_bytes;
+        the size is measured again first, as other processes write to the same directory
+        '''
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if entry.is_file() and not entry.name.startswith('.'):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.nbytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.nbytes <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.nbytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            logger.warning('disk cache listing failed', exc_info=True)
+            return
+        for entry in entries:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self.nbytes = 0
+
+
+class RedisCache:
+    '''
+    cache of pickled values in a Redis server (or anything speaking its protocol), shared by every
+    host; entries expire after ttl seconds and the server's maxmemory policy bounds the total size.
+    Errors talking to the server count as misses, so the dashboard keeps working without it.
+    '''
+    shared = True
+
+    def __init__(self, url, namespace, ttl=None, client=None):
+        if client is None:
+            if redis is None:
+                raise ImportError('redis is required for the redis cache backend')
+            # short timeouts, as a slow cache would otherwise hold up the callbacks
+            client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.client = client
+        self.prefix = '{}:'.format(namespace)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key):
+        return self.prefix + key_digest(key)
+
+    def __len__(self):
+        try:
+            return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*'))
+        except Exception:
+            logger.warning('redis cache listing failed', exc_info=True)
+            return 0
+
+    def __contains__(self, key):
+        try:
+            return bool(self.client.exists(self.path(key)))
+        except Exception:
+            logger.warning('redis cache read failed', exc_info=True)
+            return False
+
+    def get(self, key, default=None):
+        try:
+            raw = self.client.get(self.path(key))
+            value = pickle.loads(raw) if raw is not None else None
+        except Exception:
+            logger.warning('redis cache read failed', exc_info=True)
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            self.client.set(self.path(key), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), ex=self.ttl)
+        except Exception:
+            logger.warning('redis cache write failed', exc_info=True)
+
+    def clear(self):
+        try:
+            keys = list(self.client.scan_iter(match=self.prefix + '*'))
+            if keys:
+                self.client.delete(*keys)
+        except Exception:
+            logger.warning('redis cache clear failed', exc_info=True)
+
+
+def make_cache(name, max_items=None, max_bytes=None, client=None):
+    '''
+    creates the named cache in the backend chosen by CACHE_BACKEND; in the shared backends the
+    name separates caches, and the data version in their keys keeps results of different data apart.
+    The redis backend talks through client when one is given instead of connecting to CACHE_REDIS_URL,
+    and a disk cache whose directory cannot be created falls back to memory.
+    '''
+    if CACHE_BACKEND == 'memory':
+        return LRUCache(max_items=max_items, max_bytes=max_bytes)
+    if CACHE_BACKEND == 'disk':
+        try:
+            return DiskCache(os.path.join(CACHE_DIR, name), max_bytes if max_bytes is not None else 256 * 2**20)
+        except OSError:
+            logger.warning('disk cache %s unavailable, keeping it in memory', name, exc_info=True)
+            return LRUCache(max_items=max_items, max_bytes=max_bytes)
+    if CACHE_BACKEND == 'redis':
+        return RedisCache(CACHE_REDIS_URL, 'covid-dashboard:{}'.format(name), CACHE_TTL, client=client)
+    raise ValueError('unknown CACHE_BACKEND {!r}'.format(CACHE_BACKEND))
+
+
+_unloaded = object()
+
+
+class LazyHandle:
+    '''
+    value loaded on first use by one thread while the others wait for it, and dropped again by
+    unload_if_idle once it has not been used for idle_seconds, so the next use loads it anew
+    '''
+    def __init__(self, load, idle_seconds=None):
+        self.load = load
+        self.idle_seconds = idle_seconds
+        self.loads = 0
+        self.last_used = time.monotonic()
+        self._value = _unloaded
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._value is not _unloaded
+
+    def get(self):
+        self.last_used = time.monotonic()
+        value = self._value
+        if value is _unloaded:
+            with self._lock:
+                value = self._value
+                if value is _unloaded:
+                    value = self._value = self.load()
+                    self.loads += 1
+        return value
+
+    def unload_if_idle(self):
+        if not self.idle_seconds:
+            return False
+        with self._lock:
+            if self._value is _unloaded or time.monotonic() - self.last_used < self.idle_seconds:
+                return False
+            self._value = _unloaded
+            return True
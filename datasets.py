@@ -0,0 +1,442 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
+SHARED_DATA_DIR = os.environ.get('SHARED_DATA_DIR')
+
+logger = logging.getLogger(__name__)
+
+# date columns are kept as strings ('string') or parsed to datetime64 ('datetime') once loaded
+datasets = {'master': {'files': ['WHO-COVID-19-global-data.csv'],
+                       'date': 'Date_reported', 'date_type': 'string', 'region': 'Country'},
+            'worldwide': {'files': ['df_worldwide.csv'],
+                          'date': 'date', 'date_type': 'datetime', 'region': 'Country/Region'},
+            'us': {'files': ['df_us.csv'],
+                   'date': 'date', 'date_type': 'datetime', 'region': 'Country/Region'},
+            'eu': {'files': ['df_eu.csv'],
+                   'date': 'date', 'date_type': 'datetime', 'region': 'Country/Region'},
+            'china': {'files': ['df_china.csv'],
+                      'date': 'date', 'date_type': 'datetime', 'region': 'Country/Region'},
+            'us_counties': {'files': ['df_us_county1.csv', 'df_us_county2.csv',
+                                      'df_us_county3.csv', 'df_us_county4.csv'],
+                            'date': 'date', 'date_type': 'datetime', 'region': 'Country/Region',
+                            'str_region': True}}
+
+count_columns = ['Confirmed', 'Deaths', 'Recovered', 'Active',
+                 'New_cases', 'Cumulative_cases', 'New_deaths', 'Cumulative_deaths']
+float32_columns = ['Latitude', 'Longitude', 'share_of_last_week', 'percentage', 'population']
+category_columns = ['Country_code', 'WHO_region']
+
+# rows per chunk when scanning a CSV file for new dates
+CHUNK_ROWS = 100000
+
+# counts of the WHO data kept by its aggregates, and the types its CSV file is streamed with
+who_columns = ['New_cases', 'Cumulative_cases', 'New_deaths', 'Cumulative_deaths']
+who_dtypes = dict({'Date_reported': str, 'Country': 'category'}, **dict.fromkeys(who_columns, np.float64))
+
+# every date in the source files is ISO formatted
+DATE_FORMAT = '%Y-%m-%d'
+# files read at the same time when loading; the CSV parser releases the GIL while tokenizing
+LOAD_WORKERS = int(os.environ.get('LOAD_WORKERS', 4))
+
+
+def csv_paths(name):
+    return [os.path.join(DATA_DIR, f) for f in datasets[name]['files']]
+
+def columnar_path(name):
+    return os.path.join(DATA_DIR, '{}.parquet'.format(name))
+
+def read_csv_dataset(name):
+    '''
+    reads the raw CSV file(s) of a dataset into one frame
+    '''
+    paths = csv_paths(name)
+    if len(paths) == 1:
+        return pd.read_csv(paths[0])
+    return pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+
+def read_csv_file(path, name):
+    '''
+    reads one CSV file of a dataset, parsing regions and other categorical columns straight into
+    categories rather than through an object column
+    '''
+    spec = datasets[name]
+    dtypes = dict.fromkeys(category_columns, 'category')
+    if not spec.get('str_region'):
+        dtypes[spec['region']] = 'category'
+    return pd.read_csv(path, dtype=dtypes)
+
+def downcast_counts(values):
+    '''
+    stores a count column as int32 when it has no missing values and fits, otherwise leaves it as is
+    '''
+    info = np.iinfo(np.int32)
+    if values.notna().all() and (len(values) == 0 or info.min <= values.min() and values.max() <= info.max):
+        return values.astype(np.int32)
+    return values
+
+def prepare(df, name):
+    '''
+    converts a raw dataset to the compact schema used by the dashboard: categorical regions and
+    string dates, int32 counts and float32 coordinates, percentages and populations
+    '''
+    spec = datasets[name]
+    for column in df.columns:
+        if column in count_columns:
+            df[column] = downcast_counts(df[column])
+        elif column in float32_columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(np.float32)
+    if spec.get('str_region'):
+        df[spec['region']] = df[spec['region']].astype(str)
+    for column in [spec['region']] + category_columns:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype('category')
+    if spec['date_type'] == 'datetime':
+        if not pd.api.types.is_datetime64_any_dtype(df[spec['date']]):
+            df[spec['date']] = pd.to_datetime(df[spec['date']], format=DATE_FORMAT)
+    elif not isinstance(df[spec['date']].dtype, pd.CategoricalDtype):
+        df[spec['date']] = pd.Categorical(df[spec['date']], ordered=True)
+    return df
+
+def memory_report(frames):
+    '''
+    logs the rows and in-memory size of each frame
+    '''
+    for name, df in frames.items():
+        logger.info('%s: %d rows, %.1f MB', name, len(df), df.memory_usage(deep=True).sum() / 2**20)
+
+def write_columnar(df, name):
+    '''
+    writes a raw dataset as parquet, with dates as int days since epoch and regions dictionary-encoded
+    '''
+    spec = datasets[name]
+    df = df.copy()
+    df[spec['date']] = pd.to_datetime(df[spec['date']], format=DATE_FORMAT).values.astype('datetime64[D]').astype(np.int32)
+    if spec.get('str_region'):
+        df[spec['region']] = df[spec['region']].astype(str)
+    df[spec['region']] = df[spec['region']].astype('category')
+    df.to_parquet(columnar_path(name), index=False)
+
+def read_columnar(name, filters=None):
+    '''
+    reads a dataset written by write_columnar, keeping regions categorical and string dates as an
+    ordered categorical
+    '''
+    spec = datasets[name]
+    df = pd.read_parquet(columnar_path(name), filters=filters)
+    days = df[spec['date']].to_numpy()
+    if spec['date_type'] == 'datetime':
+        df[spec['date']] = days.astype('datetime64[D]').astype('datetime64[ns]')
+    else:
+        # format each distinct day once rather than once per row
+        unique_days, inverse = np.unique(days, return_inverse=True)
+        labels = pd.to_datetime(unique_days.astype('datetime64[D]')).strftime('%Y-%m-%d')
+        df[spec['date']] = pd.Categorical.from_codes(inverse, labels, ordered=True)
+    return df
+
+def columnar_is_current(name):
+    '''
+    the columnar copy is used only if it exists and is newer than all of its CSV sources
+    '''
+    path = columnar_path(name)
+    if pyarrow is None or not os.path.exists(path):
+        return False
+    mtime = os.path.getmtime(path)
+    return all(not os.path.exists(csv) or os.path.getmtime(csv) <= mtime for csv in csv_paths(name))
+
+def source_files(name):
+    '''
+    lists the files a dataset is loaded from: its columnar copy when available, otherwise its CSV file(s)
+    '''
+    if columnar_is_current(name):
+        return [columnar_path(name)]
+    return csv_paths(name)
+
+def load_part(name, path):
+    '''
+    reads and prepares one source file of a dataset, logging how long each step took
+    '''
+    start = time.perf_counter()
+    if path == columnar_path(name):
+        df = read_columnar(name)
+    else:
+        df = read_csv_file(path, name)
+    read_seconds = time.perf_counter() - start
+    df = prepare(df, name)
+    logger.info('%s: read %s in %.2f s, prepared in %.2f s (%d rows)', name, os.path.basename(path),
+                read_seconds, time.perf_counter() - start - read_seconds, len(df))
+    return df
+
+def concat_prepared(parts):
+    '''
+    joins the prepared parts of a dataset column by column, so only their compact columns are
+    copied and categorical columns stay categorical
+    '''
+    if len(parts) == 1:
+        return parts[0]
+    columns = {}
+    for column in parts[0].columns:
+        values = [part[column] for part in parts]
+        if isinstance(values[0].dtype, pd.CategoricalDtype):
+            joined = union_categoricals(values, sort_categories=True, ignore_order=True)
+            columns[column] = joined.as_ordered() if values[0].cat.ordered else joined
+        else:
+            columns[column] = np.concatenate([v.to_numpy() for v in values])
+    return pd.DataFrame(columns, copy=False)
+
+def load_all(names=None):
+    '''
+    loads the given (default: all) datasets, reading and preparing all of their files in parallel
+    on LOAD_WORKERS threads
+    '''
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        futures = {name: [executor.submit(load_part, name, path) for path in source_files(name)]
+                   for name in names or datasets}
+        frames = {name: concat_prepared([future.result() for future in parts])
+                  for name, parts in futures.items()}
+    logger.info('loaded %d files in %.2f s', sum(len(parts) for parts in futures.values()),
+                time.perf_counter() - start)
+    return frames
+
+def last_date(df, name):
+    '''
+    returns the latest date of a loaded dataset as a 'YYYY-MM-DD' string
+    '''
+    spec = datasets[name]
+    if spec['date_type'] == 'datetime':
+        return df[spec['date']].max().strftime('%Y-%m-%d')
+    return str(df[spec['date']].max())
+
+def read_rows_after(name, date):
+    '''
+    reads only the rows of a dataset dated after date ('YYYY-MM-DD'), without holding the rest
+    of the file in memory
+    '''
+    spec = datasets[name]
+    if columnar_is_current(name):
+        day = int(np.datetime64(date, 'D').astype(np.int64))
+        return read_columnar(name, filters=[(spec['date'], '>', day)])
+    parts = []
+    for path in csv_paths(name):
+        for chunk in pd.read_csv(path, chunksize=CHUNK_ROWS):
+            # dates are ISO formatted, so they compare correctly as strings
+            parts.append(chunk[chunk[spec['date']].astype(str) > date])
+    return pd.concat(parts, ignore_index=True)
+
+def file_signatures():
+    '''
+    records the size and modification time of the source files of every dataset
+    '''
+    signatures = {}
+    for name in datasets:
+        signatures[name] = [(path, os.stat(path).st_size, os.stat(path).st_mtime_ns)
+                            for path in csv_paths(name) + [columnar_path(name)] if os.path.exists(path)]
+    return signatures
+
+def refresh_frames(frames, signatures):
+    '''
+    appends the rows for dates newer than those already loaded to the given datasets whose files
+    changed; unchanged datasets are returned as they are. Revisions of already loaded dates are not picked
+    up and need a full reload.
+    '''
+    current = file_signatures()
+    refreshed = dict(frames)
+    for name in frames:
+        if current[name] == signatures.get(name):
+            continue
+        new = read_rows_after(name, last_date(frames[name], name))
+        logger.info('%s: %d new rows', name, len(new))
+        if len(new):
+            df = frames[name].drop(columns=[c for c in frames[name].columns if c not in new.columns])
+            refreshed[name] = prepare(pd.concat([df, prepare(new, name)], ignore_index=True), name)
+    return refreshed
+
+def source_version():
+    '''
+    identifies the current state of the source files from their paths, sizes and modification times
+    '''
+    digest = hashlib.sha1()
+    for name in datasets:
+        for path in csv_paths(name) + [columnar_path(name)]:
+            if os.path.exists(path):
+                stat = os.stat(path)
+                digest.update('{}:{}:{}'.format(path, stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()[:16]
+
+def publish_shared(frames, directory):
+    '''
+    writes every column of the frames as a .npy file so other processes can memory-map them;
+    object columns are dictionary-encoded into integer codes plus a list of categories
+    '''
+    staging = '{}.tmp{}'.format(directory, os.getpid())
+    os.makedirs(staging)
+    manifest = {}
+    for name, df in frames.items():
+        columns = []
+        for i, column in enumerate(df.columns):
+            entry = {'name': column, 'file': '{}.{}.npy'.format(name, i)}
+            values = df[column]
+            if values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype):
+                try:
+                    codes, categories = pd.factorize(values, sort=True)
+                    entry['ordered'] = True
+                except TypeError:
+                    codes, categories = pd.factorize(values)
+                    entry['ordered'] = False
+                entry['categories'] = categories.tolist()
+                # saved in the integer width pandas itself uses for the codes so attaching does not copy them
+                values = pd.Categorical.from_codes(codes, categories).codes
+            np.save(os.path.join(staging, entry['file']), np.asarray(values))
+            columns.append(entry)
+        manifest[name] = columns
+    with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+    os.rename(staging, directory)
+
+def attach_shared(directory):
+    '''
+    rebuilds the frames published in directory on top of read-only memory-mapped columns
+    '''
+    with open(os.path.join(directory, 'manifest.json')) as f:
+        manifest = json.load(f)
+    frames = {}
+    for name, columns in manifest.items():
+        data = {}
+        for entry in columns:
+            values = np.load(os.path.join(directory, entry['file']), mmap_mode='r')
+            if 'categories' in entry:
+                values = pd.Categorical.from_codes(values, entry['categories'], ordered=entry['ordered'])
+            data[entry['name']] = values
+        frames[name] = pd.DataFrame(data, copy=False)
+    return frames
+
+def load_shared(directory):
+    '''
+    attaches to the datasets published under directory, publishing them first when they are missing
+    or stale; only one process publishes while the others wait on the lock
+    '''
+    current = os.path.join(directory, source_version())
+    if not os.path.exists(os.path.join(current, 'manifest.json')):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.exists(os.path.join(current, 'manifest.json')):
+                publish_shared(load_all(), current)
+                # processes still attached to older versions keep their mappings after the files are removed
+                for entry in os.listdir(directory):
+                    if entry != os.path.basename(current) and not entry.startswith('.'):
+                        shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return attach_shared(current)
+
+def grown(array, rows, columns):
+    '''
+    returns a (date x country) array zero-padded to at least rows x columns; a dimension that has
+    to grow at least doubles, so folding many chunks copies each array only a few times
+    '''
+    shape = tuple(size if size >= needed else max(needed, 2 * size) for size, needed in zip(array.shape, (rows, columns)))
+    if shape == array.shape:
+        return array
+    result = np.zeros(shape, dtype=array.dtype)
+    result[:array.shape[0], :array.shape[1]] = array
+    return result
+
+def fold_who(chunks):
+    '''
+    folds chunks of WHO rows into dense (date x country) arrays of each count, with a mask of the
+    countries that reported on each date. Each chunk is added into the arrays as it is read, dates
+    and countries getting a row and a column the first time they appear, so only the dense arrays
+    and one chunk of long-form rows are held. Countries keep the order they first appear in, dates
+    are sorted at the end, missing counts count as zero and rows repeated for a date and country
+    are summed.
+    '''
+    dates, countries = {}, {}
+    reported = np.zeros((0, 0), dtype=bool)
+    values = {column: np.zeros((0, 0)) for column in who_columns}
+    for chunk in chunks:
+        date_codes, days = pd.factorize(chunk['Date_reported'])
+        country_codes, names = pd.factorize(chunk['Country'])
+        days = pd.to_datetime(np.asarray(days), format=DATE_FORMAT).values.astype('datetime64[D]')
+        rows = np.array([dates.setdefault(str(day), len(dates)) for day in days], dtype=np.intp)
+        columns = np.array([countries.setdefault(str(name), len(countries)) for name in names], dtype=np.intp)
+        reported = grown(reported, len(dates), len(countries))
+        kept = (date_codes >= 0) & (country_codes >= 0)
+        cells = (rows[date_codes[kept]], columns[country_codes[kept]])
+        reported[cells] = True
+        counts = np.nan_to_num(chunk[who_columns].to_numpy(np.float64)[kept])
+        for i, column in enumerate(who_columns):
+            values[column] = grown(values[column], len(dates), len(countries))
+            np.add.at(values[column], cells, counts[:, i])
+    # ISO dates sort as strings
+    order = np.argsort(np.array(list(dates), dtype=str), kind='stable')
+    return {'dates': sorted(dates),
+            'countries': list(countries),
+            'reported': reported[order, :len(countries)],
+            'values': {column: array[order, :len(countries)] for column, array in values.items()}}
+
+def who_is_streamed():
+    '''
+    the WHO CSV file is streamed unless the data comes from shared files or a current columnar copy
+    '''
+    return not SHARED_DATA_DIR and not columnar_is_current('master')
+
+def load_who():
+    '''
+    loads the WHO data as the aggregates of fold_who: streamed from its CSV file in chunks of
+    CHUNK_ROWS, or folded from the frame of its columnar copy or shared files
+    '''
+    start = time.perf_counter()
+    if who_is_streamed():
+        chunks = pd.read_csv(csv_paths('master')[0], usecols=list(who_dtypes), dtype=who_dtypes, chunksize=CHUNK_ROWS)
+        who = fold_who(chunks)
+    else:
+        who = fold_who([load_datasets(['master'])['master']])
+    logger.info('master: %d dates x %d countries in %.2f s, %.1f MB', len(who['dates']), len(who['countries']),
+                time.perf_counter() - start, sum(values.nbytes for values in who['values'].values()) / 2**20)
+    return who
+
+def load_datasets(names=None):
+    '''
+    loads the given (default: all) datasets, through shared memory-mapped files when SHARED_DATA_DIR
+    is set; every dataset is published there so other workers can attach to any of them
+    '''
+    if SHARED_DATA_DIR:
+        frames = load_shared(SHARED_DATA_DIR)
+        frames = {name: frames[name] for name in names or frames}
+    else:
+        frames = load_all(names)
+    memory_report(frames)
+    return frames
+
+def convert(names=None):
+    '''
+    converts the CSV files of the given (default: all) datasets into the columnar format
+    '''
+    if pyarrow is None:
+        raise ImportError('pyarrow is required to write the columnar data files')
+    for name in names or datasets:
+        write_columnar(read_csv_dataset(name), name)
+        print('wrote {}'.format(columnar_path(name)))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--publish']:
+        load_shared(sys.argv[2] if len(sys.argv) > 2 else SHARED_DATA_DIR)
+    else:
+        convert(sys.argv[1:])
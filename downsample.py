@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def lttb(y, points):
+    '''
+    picks the indices of a largest-triangle-three-buckets downsampling of y, taken at evenly spaced
+    x, to at most points points; the first and last points are always kept and NaN counts as zero
+    '''
+    n = len(y)
+    if n <= points or points < 3:
+        return np.arange(n)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    # points - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    indices = np.empty(points, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    previous = 0
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_stop = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_stop = n - 1, n
+        next_x = (next_start + next_stop - 1) / 2
+        next_y = y[next_start:next_stop].mean()
+        x = np.arange(start, stop)
+        # twice the area of the triangle each candidate makes with the previous pick and the next bucket's average
+        area = np.abs((previous - next_x) * (y[start:stop] - y[previous]) - (previous - x) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        indices[i + 1] = previous
+    return indices
+
+def detail_indices(y, points, window=None):
+    '''
+    downsamples y to about points points; within the (start, stop) window a chart is zoomed to,
+    every point is kept when they fit in points, otherwise the window is downsampled on its own
+    '''
+    indices = lttb(y, points)
+    if window is None:
+        return indices
+    start, stop = window
+    return np.union1d(indices, start + lttb(y[start:stop], points))
+
+def week_ends(n):
+    '''
+    returns the positions of the last day of each 7-day period, counted back from the latest day
+    '''
+    return np.arange(n - 1, -1, -7)[::-1]
+
+def weekly(values, how='last'):
+    '''
+    aggregates a daily series into the 7-day periods of week_ends: 'sum' for daily counts, 'last'
+    for cumulative values; the first period holds whatever days are left over and can be shorter,
+    so its sum covers fewer than 7 days (3 of them for 10 days)
+    '''
+    ends = week_ends(len(values))
+    if how == 'sum':
+        return np.add.reduceat(values, np.r_[0, ends[:-1] + 1])
+    return values[ends]
@@ -0,0 +1,25 @@
+import os
+
+# figures are built as plain dicts holding NumPy arrays rather than plotly graph objects, which
+# validate every property as it is set; Dash serializes them through plotly's JSON encoder, which
+# uses orjson (encoding NumPy arrays natively) when it is installed. FIGURE_VALIDATION=1 checks
+# each figure against the plotly schema instead, for development.
+FIGURE_VALIDATION = os.environ.get('FIGURE_VALIDATION') == '1'
+
+
+def figure(data, layout):
+    '''
+    returns a figure of the traces and layout, validated when FIGURE_VALIDATION is set
+    '''
+    result = {'data': data, 'layout': layout}
+    if FIGURE_VALIDATION:
+        import plotly.graph_objects as go
+        # raises ValueError naming the property when a trace or the layout is not valid
+        go.Figure(result)
+    return result
+
+def title(text):
+    '''
+    returns a title in the form plotly expands a title string into
+    '''
+    return {'text': text}
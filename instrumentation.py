@@ -0,0 +1,195 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import flask
+
+# upper bounds (seconds / bytes) of the histogram buckets
+time_buckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+size_buckets = [1024, 10 * 1024, 100 * 1024, 1024**2, 10 * 1024**2]
+
+_local = threading.local()
+
+
+class Histogram:
+    '''
+    cumulative-bucket histogram in the Prometheus style
+    '''
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def lines(self, name, labels):
+        result = ['{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, count)
+                  for bound, count in zip(self.buckets, self.counts)]
+        result.append('{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, self.count))
+        result.append('{}_sum{{{}}} {}'.format(name, labels, self.sum))
+        result.append('{}_count{{{}}} {}'.format(name, labels, self.count))
+        return result
+
+
+class CallbackMetrics:
+    '''
+    per-callback wall time, time per phase ('data', 'figure', 'serialize'), response size and errors
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = {}
+        self.response_bytes = {}
+        self.phases = {}
+        self.errors = {}
+
+    def record_call(self, callback, seconds, phases, failed=False):
+        with self.lock:
+            self.seconds.setdefault(callback, Histogram(time_buckets)).observe(seconds)
+            for phase, value in phases.items():
+                key = (callback, phase)
+                self.phases[key] = self.phases.get(key, 0.0) + value
+            if failed:
+                self.errors[callback] = self.errors.get(callback, 0) + 1
+
+    def record_response(self, callback, serialize_seconds, size):
+        with self.lock:
+            key = (callback, 'serialize')
+            self.phases[key] = self.phases.get(key, 0.0) + serialize_seconds
+            self.response_bytes.setdefault(callback, Histogram(size_buckets)).observe(size)
+
+    def render(self):
+        '''
+        formats the metrics in the Prometheus text exposition format
+        '''
+        with self.lock:
+            lines = ['# HELP dash_callback_seconds Wall time of each callback function.',
+                     '# TYPE dash_callback_seconds histogram']
+            for callback, histogram in sorted(self.seconds.items()):
+                lines += histogram.lines('dash_callback_seconds', 'callback="{}"'.format(callback))
+            lines += ['# HELP dash_callback_phase_seconds_total Time spent per phase: data access, figure building, JSON serialization.',
+                      '# TYPE dash_callback_phase_seconds_total counter']
+            for (callback, phase), value in sorted(self.phases.items()):
+                lines.append('dash_callback_phase_seconds_total{{callback="{}",phase="{}"}} {}'.format(callback, phase, value))
+            lines += ['# HELP dash_callback_response_bytes Size of each callback response.',
+                      '# TYPE dash_callback_response_bytes histogram']
+            for callback, histogram in sorted(self.response_bytes.items()):
+                lines += histogram.lines('dash_callback_response_bytes', 'callback="{}"'.format(callback))
+            lines += ['# HELP dash_callback_errors_total Callbacks that raised an exception.',
+                      '# TYPE dash_callback_errors_total counter']
+            for callback, count in sorted(self.errors.items()):
+                lines.append('dash_callback_errors_total{{callback="{}"}} {}'.format(callback, count))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = CallbackMetrics()
+profiles = {}
+profiles_lock = threading.Lock()
+
+
+@contextmanager
+def phase(name):
+    '''
+    attributes the time spent in the block to a phase of the callback being run; does nothing
+    outside an instrumented callback
+    '''
+    phases = getattr(_local, 'phases', None)
+    if phases is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+def instrument(func, profile_rate=0.0):
+    '''
+    wraps a callback to record its wall time and phases; the part not attributed to the 'data'
+    phase counts as figure building. A profile_rate share of calls also runs under cProfile.
+    '''
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _local.phases = {}
+        profiler = cProfile.Profile() if profile_rate and random.random() < profile_rate else None
+        start = time.perf_counter()
+        failed = True
+        try:
+            if profiler is not None:
+                result = profiler.runcall(func, *args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            seconds = time.perf_counter() - start
+            phases = _local.phases
+            _local.phases = None
+            phases['figure'] = max(seconds - phases.get('data', 0.0), 0.0)
+            metrics.record_call(name, seconds, phases, failed)
+            if profiler is not None:
+                with profiles_lock:
+                    if name in profiles:
+                        profiles[name].add(profiler)
+                    else:
+                        profiles[name] = pstats.Stats(profiler)
+            if flask.has_request_context():
+                flask.g.instrumented_callback = name
+                flask.g.callback_seconds = seconds
+    return wrapper
+
+def instrument_app(app, profile_rate=0.0, profile_dir=None):
+    '''
+    instruments every callback registered on the app from here on and adds the /metrics route
+    (and /metrics/profile/<callback> when profiling) to its server
+    '''
+    register = app.callback
+
+    def callback(*args, **kwargs):
+        decorate = register(*args, **kwargs)
+        return lambda func: decorate(instrument(func, profile_rate))
+    app.callback = callback
+
+    server = app.server
+
+    @server.before_request
+    def start_request_timer():
+        flask.g.request_start = time.perf_counter()
+
+    @server.after_request
+    def record_response(response):
+        name = flask.g.pop('instrumented_callback', None)
+        if name is not None and not response.direct_passthrough:
+            total = time.perf_counter() - flask.g.request_start
+            metrics.record_response(name, max(total - flask.g.callback_seconds, 0.0), len(response.get_data()))
+        return response
+
+    @server.route('/metrics')
+    def prometheus_metrics():
+        return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @server.route('/metrics/profile/<name>')
+    def callback_profile(name):
+        with profiles_lock:
+            if name not in profiles:
+                flask.abort(404)
+            stats = profiles[name]
+            stats.stream = output = io.StringIO()
+            stats.sort_stats('cumulative').print_stats(40)
+            if profile_dir:
+                os.makedirs(profile_dir, exist_ok=True)
+                stats.dump_stats(os.path.join(profile_dir, '{}.prof'.format(name)))
+        return flask.Response(output.getvalue(), mimetype='text/plain')
@@ -0,0 +1,112 @@
+import gzip
+import hashlib
+import json
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from cache import LRUCache
+
+
+def request_key(body):
+    '''
+    identifies a callback request by its output and the values of its inputs and state
+    '''
+    def values(items):
+        return [(item.get('id'), item.get('property'), item.get('value')) for item in items or []
+                if isinstance(item, dict)]
+    return json.dumps([body.get('output'), values(body.get('inputs')), values(body.get('state'))],
+                      sort_keys=True, default=str)
+
+def encode_variants(body, level=6):
+    '''
+    compresses a response body once into every encoding it can be served with
+    '''
+    variants = {'identity': body, 'gzip': gzip.compress(body, level)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(body, quality=level)
+    return variants
+
+def pick_encoding(variants):
+    '''
+    chooses the best encoding of a response the client accepts
+    '''
+    accepted = flask.request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and accepted[encoding]:
+            return encoding
+    return 'identity'
+
+def install_response_cache(server, outputs, get_version, max_bytes=64 * 2**20, max_age=300, cache=None,
+                           layout=False):
+    '''
+    serves repeated _dash-update-component requests for the given outputs from a response cache
+    keyed by the request and the data version, tags responses with a data-version ETag and answers
+    matching If-None-Match headers with 304. With layout, the _dash-layout response is cached the
+    same way, which suits a layout that only changes with the data version. Responses are compressed
+    once when stored and served gzip or brotli encoded to clients that accept it. The responses are
+    kept in cache when given, otherwise in an in-process LRU cache of max_bytes.
+    '''
+    responses = cache if cache is not None else LRUCache(max_bytes=max_bytes)
+
+    def etag_for(key):
+        version = get_version()
+        digest = hashlib.sha1(key.encode()).hexdigest()[:20]
+        return '{}-{}'.format(version, digest)
+
+    def cacheable_key():
+        if layout and flask.request.method == 'GET' and flask.request.path.endswith('_dash-layout'):
+            return '_dash-layout'
+        if not flask.request.path.endswith('_dash-update-component'):
+            return None
+        body = flask.request.get_json(silent=True)
+        if not isinstance(body, dict) or body.get('output') not in outputs:
+            return None
+        return request_key(body)
+
+    def add_headers(response, etag):
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, max-age={}'.format(max_age)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def encoded_response(variants, response=None):
+        encoding = pick_encoding(variants)
+        if response is None:
+            response = flask.Response(mimetype='application/json')
+        response.set_data(variants[encoding])
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    @server.before_request
+    def serve_cached():
+        key = cacheable_key()
+        if key is None:
+            return None
+        etag = etag_for(key)
+        flask.g.response_etag = etag
+        if etag in flask.request.if_none_match:
+            return add_headers(flask.Response(status=304), etag)
+        cached = responses.get(etag)
+        if cached is not None:
+            flask.g.response_cached = True
+            return add_headers(encoded_response(cached), etag)
+        return None
+
+    @server.after_request
+    def store_response(response):
+        etag = flask.g.pop('response_etag', None)
+        if etag is None or response.status_code != 200 or response.direct_passthrough:
+            return response
+        if flask.g.pop('response_cached', False):
+            return response
+        variants = encode_variants(response.get_data())
+        responses.set(etag, variants)
+        return add_headers(encoded_response(variants, response), etag)
+
+    return responses
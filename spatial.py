@@ -0,0 +1,35 @@
+import numpy as np
+
+
+def grid_cells(lon, lat, cell):
+    '''
+    assigns each point to a square grid cell of cell degrees; returns the cell of every point and
+    the first point of every cell
+    '''
+    keys = np.stack([np.floor(lon / cell), np.floor(lat / cell)], axis=1)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    return inverse.ravel(), first
+
+def aggregate_cells(lon, lat, counts, shares, cell):
+    '''
+    sums point counts into grid cells of cell degrees; each cell is placed at the count-weighted
+    centre of its points and gets their count-weighted share, the number of points in it and the
+    first of them
+    '''
+    inverse, first = grid_cells(lon, lat, cell)
+    n = len(first)
+    weights = np.asarray(counts, dtype=float)
+    totals = np.bincount(inverse, weights, minlength=n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {'lon': np.bincount(inverse, weights * lon, minlength=n) / totals,
+                'lat': np.bincount(inverse, weights * lat, minlength=n) / totals,
+                'count': totals,
+                'share': np.bincount(inverse, weights * np.nan_to_num(shares), minlength=n) / totals,
+                'points': np.bincount(inverse, minlength=n),
+                'first': first}
+
+def within(lon, lat, center, half_width, half_height):
+    '''
+    selects the points inside the box of half_width by half_height degrees around center (lon, lat)
+    '''
+    return (np.abs(lon - center[0]) <= half_width) & (np.abs(lat - center[1]) <= half_height)
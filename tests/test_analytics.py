@@ -0,0 +1,101 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import daily, doubling_time, growth, moving_average, rolling_sum, shifted
+from downsample import lttb, week_ends, weekly
+from spatial import aggregate_cells
+
+
+def cumulative_counts():
+    '''
+    cumulative counts of two regions over 30 dates, the first with a missing date, the second flat
+    for a while
+    '''
+    rng = np.random.default_rng(0)
+    first = np.cumsum(rng.integers(0, 50, 30)).astype(float)
+    first[12] = np.nan
+    second = np.r_[np.zeros(10), np.cumsum(rng.integers(1, 20, 20))].astype(float)
+    return np.stack([first, second], axis=1)
+
+
+@pytest.mark.parametrize('window', [1, 7, 14, 40])
+def test_rolling_sum_matches_pandas(window):
+    values = daily(cumulative_counts())
+    expected = pd.DataFrame(values).rolling(window).sum().to_numpy()
+    np.testing.assert_allclose(rolling_sum(values, window), expected, equal_nan=True)
+    np.testing.assert_allclose(moving_average(values, window), expected / window, equal_nan=True)
+
+
+def test_shifted_matches_pandas():
+    values = cumulative_counts()
+    for periods in (0, 7, 30, 31):
+        np.testing.assert_array_equal(shifted(values, periods), pd.DataFrame(values).shift(periods).to_numpy())
+
+
+def test_growth_matches_pandas():
+    values = daily(cumulative_counts())
+    current = pd.DataFrame(values).rolling(7).sum()
+    expected = (100 * (current / current.shift(7) - 1)).replace([np.inf, -np.inf], np.nan).to_numpy()
+    np.testing.assert_allclose(growth(values, 7), expected, equal_nan=True)
+
+
+def test_doubling_time_matches_pandas():
+    cumulative = pd.DataFrame(cumulative_counts())
+    expected = (7 * np.log(2) / np.log(cumulative / cumulative.shift(7))).replace([np.inf, -np.inf], np.nan)
+    expected = expected.where(expected > 0).to_numpy()
+    result = doubling_time(cumulative.to_numpy(), 7)
+    np.testing.assert_allclose(result, expected, equal_nan=True)
+    # the dates compared with the gap and those without growth have no doubling time
+    assert np.isnan(result[[12, 19], 0]).all() and np.isnan(result[:17, 1]).all()
+
+
+def test_lttb_keeps_endpoints_in_order():
+    y = np.sin(np.linspace(0, 20, 1000)) * np.linspace(1, 5, 1000)
+    y[500] = np.nan
+    indices = lttb(y, 100)
+    assert len(indices) == 100
+    assert indices[0] == 0 and indices[-1] == 999
+    assert (np.diff(indices) > 0).all()
+
+
+def test_lttb_keeps_short_series():
+    np.testing.assert_array_equal(lttb(np.arange(10.0), 10), np.arange(10))
+    np.testing.assert_array_equal(lttb(np.arange(10.0), 2), np.arange(10))
+
+
+def test_lttb_picks_a_spike():
+    y = np.zeros(300)
+    y[123] = 10
+    assert 123 in lttb(y, 20)
+
+
+def test_weekly():
+    values = np.arange(10.0)
+    np.testing.assert_array_equal(week_ends(10), [2, 9])
+    np.testing.assert_array_equal(weekly(values, 'last'), [2, 9])
+    # the first period only holds the 3 days left over
+    np.testing.assert_array_equal(weekly(values, 'sum'), [0 + 1 + 2, sum(range(3, 10))])
+    np.testing.assert_array_equal(weekly(np.arange(14.0), 'sum'), [21, 70])
+
+
+def test_aggregate_cells():
+    lon = np.array([0.2, 0.8, 5.5, 0.4])
+    lat = np.array([0.1, 0.9, 5.5, 0.5])
+    cells = aggregate_cells(lon, lat, np.array([1, 3, 2, 0]), np.array([0.5, np.nan, 1.0, 0.2]), 1.0)
+    np.testing.assert_array_equal(cells['count'], [4, 2])
+    np.testing.assert_array_equal(cells['points'], [3, 1])
+    np.testing.assert_array_equal(cells['first'], [0, 2])
+    np.testing.assert_allclose(cells['lon'], [(0.2 + 3 * 0.8) / 4, 5.5])
+    np.testing.assert_allclose(cells['share'], [0.5 / 4, 1.0])
+
+
+def test_aggregate_cells_empty():
+    empty = np.array([])
+    cells = aggregate_cells(empty, empty, empty, empty, 1.0)
+    assert all(len(values) == 0 for values in cells.values())
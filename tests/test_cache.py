@@ -0,0 +1,134 @@
+import fnmatch
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+from cache import DiskCache, LRUCache, RedisCache, make_cache
+
+
+class StandInRedis:
+    '''
+    in-memory stand-in for the part of the redis client the cache uses
+    '''
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+
+    def get(self, name):
+        return self.values.get(name)
+
+    def set(self, name, value, ex=None):
+        self.values[name] = value
+        self.expiry[name] = ex
+
+    def exists(self, name):
+        return int(name in self.values)
+
+    def scan_iter(self, match='*'):
+        return iter([name for name in self.values if fnmatch.fnmatchcase(name, match)])
+
+    def delete(self, *names):
+        for name in names:
+            self.values.pop(name, None)
+
+
+class UnreachableRedis:
+    '''
+    stand-in for a redis server that cannot be reached
+    '''
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError('redis is down')
+        return fail
+
+
+def shared_caches(tmp_path):
+    return [DiskCache(str(tmp_path / 'disk'), max_bytes=2**20),
+            RedisCache('redis://stand-in', 'test', ttl=60, client=StandInRedis())]
+
+
+@pytest.mark.parametrize('index', [0, 1], ids=['disk', 'redis'])
+def test_round_trip(tmp_path, index):
+    store = shared_caches(tmp_path)[index]
+    key = ('version', 'Worldwide', 3)
+    value = {'lon': np.arange(4.0), 'label': np.array(['a', 'b'], dtype=object)}
+    assert store.get(key) is None
+    store.set(key, value)
+    assert key in store
+    assert len(store) == 1
+    cached = store.get(key)
+    np.testing.assert_array_equal(cached['lon'], value['lon'])
+    assert list(cached['label']) == ['a', 'b']
+    assert (store.hits, store.misses) == (1, 1)
+    store.clear()
+    assert key not in store
+    assert len(store) == 0
+
+
+def test_redis_namespaces_and_ttl():
+    client = StandInRedis()
+    first = RedisCache('redis://stand-in', 'first', ttl=60, client=client)
+    second = RedisCache('redis://stand-in', 'second', ttl=60, client=client)
+    first.set(('key',), 1)
+    second.set(('key',), 2)
+    assert (first.get(('key',)), second.get(('key',))) == (1, 2)
+    assert set(client.expiry.values()) == {60}
+    first.clear()
+    assert first.get(('key',)) is None
+    assert second.get(('key',)) == 2
+
+
+def test_redis_outage_counts_as_miss():
+    store = RedisCache('redis://stand-in', 'test', client=UnreachableRedis())
+    store.set(('key',), 1)
+    assert store.get(('key',), 'default') == 'default'
+    assert ('key',) not in store
+    assert len(store) == 0
+    store.clear()
+    assert store.misses == 1
+
+
+def test_disk_write_errors_are_not_raised(tmp_path):
+    store = DiskCache(str(tmp_path / 'disk'))
+    # a lock cannot be pickled
+    store.set(('key',), threading.Lock())
+    assert store.get(('key',)) is None
+    assert os.listdir(store.directory) == []
+
+
+def test_disk_prunes_least_recently_used(tmp_path):
+    store = DiskCache(str(tmp_path / 'disk'), max_bytes=3000)
+    for i in range(4):
+        store.set(('key', i), np.zeros(100))
+        os.utime(store.path(('key', i)), (i, i))
+    store.set(('key', 4), np.zeros(100))
+    assert store.evictions > 0
+    assert ('key', 0) not in store
+    assert ('key', 4) in store
+
+
+def test_make_cache_uses_the_given_client(monkeypatch, tmp_path):
+    client = StandInRedis()
+    monkeypatch.setattr(cache, 'CACHE_BACKEND', 'redis')
+    store = make_cache('map_frames', client=client)
+    assert isinstance(store, RedisCache) and store.shared
+    store.set(('key',), 1)
+    assert list(client.values) == [store.path(('key',))]
+    monkeypatch.setattr(cache, 'CACHE_BACKEND', 'disk')
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path))
+    assert isinstance(make_cache('map_frames', max_bytes=2**20), DiskCache)
+
+
+def test_make_cache_falls_back_to_memory_without_a_cache_dir(monkeypatch, tmp_path):
+    blocked = tmp_path / 'blocked'
+    blocked.write_text('')
+    monkeypatch.setattr(cache, 'CACHE_BACKEND', 'disk')
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(blocked))
+    store = make_cache('map_frames', max_bytes=2**20)
+    assert isinstance(store, LRUCache) and not store.shared
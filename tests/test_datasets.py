@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datasets import fold_who, who_columns
+
+
+def who_rows():
+    '''
+    long-form WHO rows out of date order, with rows repeated for a date and country, missing
+    counts and a country missing from one date
+    '''
+    rows = pd.DataFrame({'Date_reported': ['2020-01-03', '2020-01-01', '2020-01-02', '2020-01-01', '2020-01-03',
+                                           '2020-01-02', '2020-01-01', '2020-01-03', '2020-01-03'],
+                         'Country': ['Italy', 'Italy', 'France', 'France', 'Italy', 'Italy', 'Italy', 'Spain', 'France']})
+    rng = np.random.default_rng(1)
+    for column in who_columns:
+        rows[column] = rng.integers(0, 100, len(rows)).astype(float)
+    rows.loc[[2, 4], 'New_cases'] = np.nan
+    rows.loc[6, 'Cumulative_deaths'] = np.nan
+    rows['Country'] = rows['Country'].astype('category')
+    return rows
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 2, 4, 100])
+def test_fold_who_matches_groupby(chunk_rows):
+    rows = who_rows()
+    who = fold_who(rows.iloc[start:start + chunk_rows] for start in range(0, len(rows), chunk_rows))
+    assert who['dates'] == ['2020-01-01', '2020-01-02', '2020-01-03']
+    assert who['countries'] == ['Italy', 'France', 'Spain']
+    groups = rows.groupby(['Date_reported', 'Country'], observed=True)
+    def dense(totals):
+        return totals.unstack().reindex(index=who['dates'], columns=who['countries'])
+    np.testing.assert_array_equal(who['reported'], dense(groups.size()).notna().to_numpy())
+    totals = groups[who_columns].sum()
+    for column in who_columns:
+        np.testing.assert_array_equal(who['values'][column], dense(totals[column]).fillna(0).to_numpy())